@@ -1,31 +1,75 @@
-from db import Database
-from typing import List, Dict, Any, Optional
+from db import Database, resolve_profile
+from config_parser import get_config
+from cache import LRUCache, MISSING
+from catalogue import GroupCatalogue
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
+import csv
+import gzip
+import io
 import json
+import threading
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
-import os
 from datetime import datetime
 
 class Backend:
     def __init__(self):
-        self.db = Database()
+        self.config = get_config()
+        self.db = Database(
+            self.config.get_db_name(),
+            self.config.get_db_pool_size(),
+            resolve_profile(self.config.get_db_profile(), self.config.get_db_pragmas())
+        )
+        
+        cache_size = self.config.get_cache_size()
+        cache_ttl = self.config.get_cache_ttl()
+        self.users_cache = LRUCache(cache_size, cache_ttl)
+        self.drivers_cache = LRUCache(cache_size, cache_ttl)
+        self.orders_cache = LRUCache(cache_size, cache_ttl)
+        # Отметки активности пишутся в БД не чаще раза в cache_ttl на пользователя
+        self.activity_cache = LRUCache(cache_size, cache_ttl)
+        self.groups = GroupCatalogue(self.db)
+        self._export_cache = {}
+        self._export_cache_lock = threading.Lock()
+    
+    @staticmethod
+    def _copy(row: Optional[Dict]) -> Optional[Dict]:
+        return dict(row) if row else row
+    
+    def _invalidate_user(self, user_id: int):
+        self.users_cache.invalidate(user_id)
+        self.drivers_cache.invalidate(user_id)
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        return {
+            'users': self.users_cache.stats(),
+            'drivers': self.drivers_cache.stats(),
+            'orders': self.orders_cache.stats(),
+        }
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        return self._copy(self.users_cache.get_or_load(user_id, lambda: self.db.get_user(user_id)))
     
     def register_user(self, user_id: int, username: str, first_name: str, last_name: str, phone: str = None, role: str = 'user'):
-        existing_user = self.db.get_user(user_id)
-        if existing_user:
-            self.db.execute(
-                "UPDATE users SET username = ?, first_name = ?, last_name = ?, phone = ? WHERE user_id = ?",
-                (username, first_name, last_name, phone, user_id)
-            )
-        else:
-            self.db.add_user(user_id, username, first_name, last_name, phone, role)
+        # Один upsert вместо чтения и отдельной записи; сохранённый телефон не затирается пустым
+        self.db.upsert_users([{
+            'user_id': user_id, 'username': username, 'first_name': first_name,
+            'last_name': last_name, 'phone': phone, 'role': role,
+        }])
+        self._invalidate_user(user_id)
 
     def update_user_phone(self, user_id: int, phone: str):
         self.db.update_user_phone(user_id, phone)
+        self._invalidate_user(user_id)
+    
+    def set_user_role(self, user_id: int, role: str):
+        self.db.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
+        self._invalidate_user(user_id)
     
     def get_user_role(self, user_id: int) -> Optional[str]:
-        user = self.db.get_user(user_id)
+        user = self.get_user(user_id)
         return user.get('role') if user else None
     
 
@@ -33,27 +77,36 @@ class Backend:
         return self.db.get_user_by_phone(phone)
     
     def remove_driver(self, username: str) -> bool:
-        user = self.db.fetch_one("SELECT user_id FROM users WHERE username = ?", (username,))
-        if not user:
-            return False
-        
-        driver_user_id = user['user_id']
-        
-        self.db.execute("DELETE FROM order_responses WHERE driver_id = ?", (driver_user_id,))
-        self.db.execute("DELETE FROM driver_offers WHERE driver_id = ?", (driver_user_id,))
-        self.db.execute("DELETE FROM drivers WHERE user_id = ?", (driver_user_id,))
-        self.db.execute("UPDATE users SET role = 'user' WHERE user_id = ?", (driver_user_id,))
+        with self.db.transaction():
+            user = self.db.fetch_one("SELECT user_id FROM users WHERE username = ?", (username,))
+            if not user:
+                return False
+            
+            driver_user_id = user['user_id']
+            
+            self.db.execute("DELETE FROM order_responses WHERE driver_id = ?", (driver_user_id,))
+            self.db.execute("DELETE FROM driver_offers WHERE driver_id = ?", (driver_user_id,))
+            self.db.execute("DELETE FROM drivers WHERE user_id = ?", (driver_user_id,))
+            self.db.execute("UPDATE users SET role = 'user' WHERE user_id = ?", (driver_user_id,))
         
+        self._invalidate_user(driver_user_id)
         return True
     
-    def get_driver_info(self, user_id: int) -> Optional[Dict]:
+    def _load_driver(self, user_id: int) -> Optional[Dict]:
         driver = self.db.get_driver(user_id)
         if driver and driver.get('group_id'):
-            group = self.db.get_group(driver['group_id'])
-            if group:
-                driver['group_name'] = group['group_name']
+            group_name = self.groups.name(driver['group_id'])
+            if group_name:
+                driver['group_name'] = group_name
         return driver
     
+    def get_driver_info(self, user_id: int) -> Optional[Dict]:
+        return self._copy(self.drivers_cache.get_or_load(user_id, lambda: self._load_driver(user_id)))
+    
+    def update_driver_phone(self, user_id: int, phone: str):
+        self.db.execute("UPDATE drivers SET phone = ? WHERE user_id = ?", (phone, user_id))
+        self.drivers_cache.invalidate(user_id)
+    
     def get_driver_by_username(self, username: str) -> Optional[Dict]:
         return self.db.fetch_one(
             "SELECT d.*, u.username FROM drivers d JOIN users u ON d.user_id = u.user_id WHERE u.username = ?",
@@ -61,19 +114,19 @@ class Backend:
         )
     
     def accept_order(self, order_id: int, driver_id: int) -> bool:
-        responses = self.db.get_order_responses(order_id)
-        if responses:
-            return False
-        
-        self.db.add_order_response(order_id, driver_id)
-        return True
+        return self.db.add_order_response(order_id, driver_id)
     
     def is_order_taken(self, order_id: int) -> bool:
-        responses = self.db.get_order_responses(order_id)
-        return len(responses) > 0
+        return self.db.fetch_one(
+            "SELECT 1 FROM order_responses WHERE order_id = ?", (order_id,)
+        ) is not None
     
     def get_order_info(self, order_id: int) -> Optional[Dict]:
-        return self.db.get_order(order_id)
+        return self._copy(self.orders_cache.get_or_load(order_id, lambda: self.db.get_order(order_id)))
+    
+    def set_order_topic(self, order_id: int, topic_id: int):
+        self.db.execute("UPDATE orders SET topic_id = ? WHERE order_id = ?", (topic_id, order_id))
+        self.orders_cache.invalidate(order_id)
     
     def get_driver_orders_history(self, driver_id: int, limit: int = 10) -> List[Dict]:
         return self.db.get_driver_orders(driver_id, limit)
@@ -87,97 +140,120 @@ class Backend:
     def get_all_drivers(self) -> List[Dict]:
         return self.db.get_all_drivers()
     
-    def export_users(self) -> str:
-        users = self.get_all_users()
-        if not users:
-            return "Нет пользователей для экспорта"
-        
-        result = "Список пользователей:\n\n"
-        for user in users:
-            result += f"ID: {user['user_id']}\n"
-            result += f"Username: @{user['username']}\n"
-            result += f"Имя: {user['first_name']} {user['last_name']}\n"
-            result += f"Роль: {user['role']}\n"
-            result += f"Дата регистрации: {user['created_at']}\n"
-            result += "─" * 30 + "\n"
-        
-        return result
+    TEXT_PAGE_LIMIT = 4096
+    TEXT_EXPORT_TITLES = {
+        'users': ("Список пользователей:\n\n", "Нет пользователей для экспорта"),
+        'drivers': ("Список водителей:\n\n", "Нет водителей для экспорта"),
+    }
     
-    def export_users_excel(self) -> str:
-        users = self.get_all_users()
-        if not users:
-            return None
-        
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Пользователи"
+    @staticmethod
+    def _user_text(user: Dict) -> str:
+        return (
+            f"ID: {user['user_id']}\n"
+            f"Username: @{user['username']}\n"
+            f"Имя: {user['first_name']} {user['last_name']}\n"
+            f"Роль: {user['role']}\n"
+            f"Дата регистрации: {user['created_at']}\n"
+            + "─" * 30 + "\n"
+        )
+    
+    @staticmethod
+    def _driver_text(driver: Dict) -> str:
+        return (
+            f"ID: {driver['user_id']}\n"
+            f"ФИО: {driver['full_name']}\n"
+            f"Телефон: {driver['phone']}\n"
+            f"Группа: {driver['group_name'] or 'Не указана'}\n"
+            f"Username: @{driver['username']}\n"
+            + "─" * 30 + "\n"
+        )
+    
+    def _export_records(self, kind: str, after_id: int = None, before_id: int = None) -> Iterator[Tuple[int, str]]:
+        if kind == 'users':
+            rows, render = self.db.iter_users(after_id=after_id, before_id=before_id), self._user_text
+        elif kind == 'drivers':
+            rows, render = self.db.iter_drivers_with_groups(after_id=after_id, before_id=before_id), self._driver_text
+        else:
+            raise ValueError(f"Unknown export kind '{kind}'")
+        return ((row['user_id'], render(row)) for row in rows)
+    
+    def get_export_page(self, kind: str, page: int = 0, after_id: int = None,
+                        before_id: int = None) -> Tuple[Optional[str], int, Optional[int], Optional[int], bool]:
+        # Страница читается от ключа соседней (after_id / before_id), а не пересобирается с первой строки.
+        # Возвращает текст, номер страницы, первый и последний user_id на ней и признак следующей страницы
+        limit = self.TEXT_PAGE_LIMIT
+        backwards = before_id is not None
+        records = self._export_records(kind, after_id, before_id)
+        title, empty_text = self.TEXT_EXPORT_TITLES[kind]
+        first_page = after_id is None and not backwards
         
-        headers = ["ID", "Username", "Имя", "Фамилия", "Роль", "Дата регистрации"]
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
+        chunk = []
+        size = len(title) if first_page else 0
+        has_more = False
+        try:
+            for key, record in records:
+                record = record[:limit]
+                if size and size + len(record) > limit:
+                    has_more = True
+                    break
+                chunk.append((key, record))
+                size += len(record)
+        finally:
+            # Закрываем генератор явно, чтобы сразу вернуть соединение в пул
+            records.close()
         
-        for row_num, user in enumerate(users, 2):
-            ws.cell(row=row_num, column=1, value=user['user_id'])
-            ws.cell(row=row_num, column=2, value=f"@{user['username']}" if user['username'] else "")
-            ws.cell(row=row_num, column=3, value=user['first_name'] or "")
-            ws.cell(row=row_num, column=4, value=user['last_name'] or "")
-            ws.cell(row=row_num, column=5, value=user['role'])
-            ws.cell(row=row_num, column=6, value=user['created_at'])
+        if backwards:
+            if not has_more:
+                # Дошли до начала списка: первая страница собирается заново, вместе с заголовком
+                return self.get_export_page(kind)
+            chunk.reverse()
+            has_more = True
         
-        column_widths = [10, 15, 15, 15, 10, 20]
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(i)].width = width
+        if not chunk:
+            return (empty_text if first_page else None), page, None, None, False
         
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
+        text = (title if first_page else "") + "".join(record for _, record in chunk)
+        return text, page, chunk[0][0], chunk[-1][0], has_more
+    
+    USERS_EXPORT_HEADERS = ["ID", "Username", "Имя", "Фамилия", "Роль", "Дата регистрации"]
+    USERS_EXPORT_WIDTHS = [10, 15, 15, 15, 10, 20]
+    DRIVERS_EXPORT_HEADERS = ["ID", "Username", "ФИО", "Телефон", "Группа", "Дата регистрации"]
+    DRIVERS_EXPORT_WIDTHS = [10, 15, 25, 15, 15, 20]
+    EXPORT_FORMATS = ('xlsx', 'csv', 'csv.gz')
+    
+    @staticmethod
+    def _user_export_row(user: Dict) -> tuple:
+        return (
+            user['user_id'],
+            f"@{user['username']}" if user['username'] else "",
+            user['first_name'] or "",
+            user['last_name'] or "",
+            user['role'],
+            user['created_at'],
+        )
+    
+    @staticmethod
+    def _driver_export_row(driver: Dict) -> tuple:
+        return (
+            driver['user_id'],
+            f"@{driver['username']}" if driver['username'] else "",
+            driver['full_name'],
+            driver['phone'],
+            driver['group_name'] or "Не указана",
+            driver['created_at'],
         )
-        
-        for row in ws.iter_rows(min_row=1, max_row=len(users)+1, max_col=len(headers)):
-            for cell in row:
-                cell.border = thin_border
-        
-        filename = f"users_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filepath = os.path.join(os.getcwd(), filename)
-        wb.save(filepath)
-        
-        return filepath
     
-    def export_drivers_excel(self) -> str:
-        drivers = self.get_all_drivers()
-        if not drivers:
+    def _write_excel(self, title: str, headers: List[str], widths: List[int], rows: Iterable[tuple]) -> Optional[io.BytesIO]:
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
             return None
         
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Водители"
-        
-        headers = ["ID", "Username", "ФИО", "Телефон", "Группа", "Дата регистрации"]
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for row_num, driver in enumerate(drivers, 2):
-            group_name = "Не указана"
-            if driver.get('group_id'):
-                group = self.db.get_group(driver['group_id'])
-                if group:
-                    group_name = group['group_name']
-            
-            ws.cell(row=row_num, column=1, value=driver['user_id'])
-            ws.cell(row=row_num, column=2, value=f"@{driver['username']}" if driver['username'] else "")
-            ws.cell(row=row_num, column=3, value=driver['full_name'])
-            ws.cell(row=row_num, column=4, value=driver['phone'])
-            ws.cell(row=row_num, column=5, value=group_name)
-            ws.cell(row=row_num, column=6, value=driver['created_at'])
+        # write-only режим: строки сбрасываются по мере записи, память не растёт
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(title)
         
-        column_widths = [10, 15, 25, 15, 15, 20]
-        for i, width in enumerate(column_widths, 1):
+        for i, width in enumerate(widths, 1):
             ws.column_dimensions[get_column_letter(i)].width = width
         
         thin_border = Border(
@@ -186,53 +262,151 @@ class Backend:
             top=Side(style='thin'),
             bottom=Side(style='thin')
         )
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = Font(bold=True)
+            cell.alignment = Alignment(horizontal='center')
+            cell.border = thin_border
+            header_cells.append(cell)
+        ws.append(header_cells)
         
-        for row in ws.iter_rows(min_row=1, max_row=len(drivers)+1, max_col=len(headers)):
-            for cell in row:
-                cell.border = thin_border
+        ws.append(first_row)
+        for row in rows:
+            ws.append(row)
         
-        filename = f"drivers_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filepath = os.path.join(os.getcwd(), filename)
-        wb.save(filepath)
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        return buffer
+    
+    def _write_csv(self, headers: List[str], rows: Iterable[tuple], compress: bool = False) -> Optional[io.BytesIO]:
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            return None
         
-        return filepath
+        buffer = io.BytesIO()
+        raw = gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer
+        # utf-8-sig, чтобы Excel правильно открывал кириллицу
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        writer = csv.writer(text)
+        writer.writerow(headers)
+        writer.writerow(first_row)
+        writer.writerows(rows)
+        text.flush()
+        text.detach()
+        if compress:
+            raw.close()
+        return buffer
     
-    def export_drivers(self) -> str:
-        drivers = self.get_all_drivers()
-        if not drivers:
-            return "Нет водителей для экспорта"
+    def _export_source(self, kind: str, since: str = None):
+        if kind == 'users':
+            return (
+                "Пользователи",
+                self.USERS_EXPORT_HEADERS,
+                self.USERS_EXPORT_WIDTHS,
+                (self._user_export_row(user) for user in self.db.iter_users(since=since))
+            )
+        if kind == 'drivers':
+            return (
+                "Водители",
+                self.DRIVERS_EXPORT_HEADERS,
+                self.DRIVERS_EXPORT_WIDTHS,
+                (self._driver_export_row(driver) for driver in self.db.iter_drivers_with_groups(since=since))
+            )
+        raise ValueError(f"Unknown export kind '{kind}'")
+    
+    @staticmethod
+    def _with_progress(rows: Iterable[tuple], total: int, progress: Callable[[int, int], None], step: int = 1000) -> Iterator[tuple]:
+        done = 0
+        for row in rows:
+            yield row
+            done += 1
+            if done % step == 0:
+                progress(done, total)
+        if done % step or not done:
+            progress(done, total)
+    
+    def export_file(self, kind: str, fmt: str = 'xlsx', progress: Callable[[int, int], None] = None,
+                    since: str = None) -> Optional[io.BytesIO]:
+        if fmt not in self.EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', expected one of {self.EXPORT_FORMATS}")
         
-        result = "Список водителей:\n\n"
-        for driver in drivers:
-            group_name = "Не указана"
-            if driver.get('group_id'):
-                group = self.db.get_group(driver['group_id'])
-                if group:
-                    group_name = group['group_name']
-            
-            result += f"ID: {driver['user_id']}\n"
-            result += f"ФИО: {driver['full_name']}\n"
-            result += f"Телефон: {driver['phone']}\n"
-            result += f"Группа: {group_name}\n"
-            result += f"Username: @{driver['username']}\n"
-            result += "─" * 30 + "\n"
+        title, headers, widths, rows = self._export_source(kind, since)
+        if progress:
+            rows = self._with_progress(rows, self.db.count_export_rows(kind, since), progress)
+        if fmt == 'xlsx':
+            buffer = self._write_excel(title, headers, widths, rows)
+        else:
+            buffer = self._write_csv(headers, rows, compress=fmt == 'csv.gz')
+        if buffer is None:
+            return None
         
-        return result
+        suffix = "changes" if since else "export"
+        buffer.name = f"{kind}_{suffix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        buffer.seek(0)
+        return buffer
+    
+    EXPORT_DEPENDENCIES = {
+        'users': ('users',),
+        'drivers': ('drivers', 'users', 'groups'),
+    }
+    
+    def export_version(self, kind: str) -> tuple:
+        versions = self.db.get_data_versions(self.EXPORT_DEPENDENCIES[kind])
+        return tuple(versions.get(table, 0) for table in self.EXPORT_DEPENDENCIES[kind])
+    
+    def get_cached_export(self, kind: str, fmt: str) -> Optional[str]:
+        with self._export_cache_lock:
+            cached = self._export_cache.get((kind, fmt))
+        if cached and cached['version'] == self.export_version(kind):
+            return cached['file_id']
+        return None
+    
+    def remember_export(self, kind: str, fmt: str, version: tuple, file_id: str):
+        with self._export_cache_lock:
+            self._export_cache[(kind, fmt)] = {'version': version, 'file_id': file_id}
+    
+    def forget_export(self, kind: str, fmt: str):
+        with self._export_cache_lock:
+            self._export_cache.pop((kind, fmt), None)
+    
+    def get_export_watermark(self, kind: str) -> Optional[str]:
+        return self.db.get_export_watermark(kind)
+    
+    def next_export_watermark(self, kind: str) -> Optional[str]:
+        # Берётся до выгрузки: строки, изменённые во время неё, попадут и в следующую
+        return self.db.get_last_update(kind)
+    
+    def set_export_watermark(self, kind: str, exported_at: str):
+        self.db.set_export_watermark(kind, exported_at)
     
     def add_group(self, group_name: str) -> int:
-        return self.db.add_group(group_name)
+        group_id = self.db.add_group(group_name)
+        self.groups.refresh()
+        return group_id
 
     def get_all_groups(self) -> List[Dict]:
-        return self.db.get_all_groups()
+        return self.groups.all()
+
+    def get_group(self, group_id: int) -> Optional[Dict]:
+        return self.groups.get(group_id)
 
     def delete_group(self, group_id: int):
         self.db.delete_group(group_id)
+        self.groups.refresh()
+        # group_name хранится в кэшированных записях водителей
+        self.drivers_cache.clear()
 
     def get_group_by_name(self, group_name: str) -> Optional[Dict]:
-        return self.db.get_group_by_name(group_name)
+        return self.groups.get_by_name(group_name)
 
     def register_driver(self, user_id: int, full_name: str, phone: str, group_id: int):
         self.db.add_driver(user_id, full_name, phone, group_id)
+        self._invalidate_user(user_id)
+
+    def get_group_driver_counts(self) -> List[Dict]:
+        return self.db.get_group_driver_counts()
 
     def get_drivers_by_group(self, group_id: int) -> List[Dict]:
         return self.db.get_drivers_by_group(group_id)
@@ -246,5 +420,31 @@ class Backend:
     def get_order_offers(self, order_id: int) -> List[Dict]:
         return self.db.get_order_offers(order_id)
 
-    def accept_driver_offer(self, offer_id: int) -> bool:
-        return self.db.accept_driver_offer(offer_id)
\ No newline at end of file
+    def accept_driver_offer(self, order_id: int, driver_id: int) -> bool:
+        return self.db.accept_driver_offer(order_id, driver_id)
+
+    def enqueue_audience(self, order_id: int, group_ids: Optional[List[int]] = None) -> int:
+        return self.db.enqueue_audience(
+            order_id,
+            group_ids,
+            busy_hours=self.config.get_broadcast_busy_hours(),
+            inactive_days=self.config.get_broadcast_inactive_days()
+        )
+
+    def touch_user(self, user_id: int):
+        if self.activity_cache.get(user_id) is not MISSING:
+            return
+        self.activity_cache.set(user_id, True)
+        self.db.touch_user(user_id)
+
+    def get_pending_deliveries(self, order_id: int) -> List[Dict]:
+        return self.db.get_pending_deliveries(order_id)
+
+    def get_orders_with_pending_deliveries(self) -> List[int]:
+        return self.db.get_orders_with_pending_deliveries()
+
+    def mark_delivery_sent(self, outbox_id: int):
+        self.db.mark_delivery_sent(outbox_id)
+
+    def mark_delivery_failed(self, outbox_id: int, error: str, retry: bool = False):
+        self.db.mark_delivery_failed(outbox_id, error, retry, self.config.get_broadcast_max_attempts())
\ No newline at end of file
@@ -0,0 +1,131 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - max(self._last, self._paused_until)) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+
+class BroadcastEngine:
+    def __init__(self, workers: int = 8, global_rate: float = 30.0, per_chat_interval: float = 1.0,
+                 max_retries: int = 3, backoff: float = 1.0):
+        self.workers = max(1, workers)
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._chat_next = {}
+        self._chat_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        # Уже начатые доставки завершаются, новые не берутся
+        self._stopped.set()
+
+    def _wait_for_chat(self, chat_id: int):
+        # Резервируем слот для чата заранее, чтобы параллельные вызовы не превышали лимит
+        with self._chat_lock:
+            now = time.monotonic()
+            slot = max(now, self._chat_next.get(chat_id, 0.0))
+            self._chat_next[chat_id] = slot + self.per_chat_interval
+            if len(self._chat_next) > 10000:
+                self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _mark_sent(self, chat_id: int):
+        # Глобальная очередь могла задержать отправку: отсчитываем интервал от фактического времени
+        with self._chat_lock:
+            sent_at = time.monotonic()
+            self._chat_next[chat_id] = max(self._chat_next.get(chat_id, 0.0), sent_at + self.per_chat_interval)
+
+    @staticmethod
+    def _retry_after(error: ApiTelegramException) -> Optional[float]:
+        if error.error_code != 429:
+            return None
+        parameters = (error.result_json or {}).get('parameters') or {}
+        return float(parameters.get('retry_after', 1))
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        # 5xx и сетевые ошибки могут пройти позже, остальные отказы окончательны
+        if isinstance(error, ApiTelegramException):
+            return error.error_code >= 500 or error.error_code == 429
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def call(self, chat_id: int, method: Callable, *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            self._wait_for_chat(chat_id)
+            self.global_bucket.acquire()
+            self._mark_sent(chat_id)
+            try:
+                return method(*args, **kwargs)
+            except ApiTelegramException as e:
+                retry_after = self._retry_after(e)
+                if retry_after is not None:
+                    # 429 не считается попыткой: ждём, сколько просит Telegram
+                    self.global_bucket.pause(retry_after)
+                    continue
+                if e.error_code < 500 or attempt >= self.max_retries:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    def run(self, recipients: Iterable[Dict], deliver: Callable[[Dict], None],
+            progress: Callable[[int, int], None] = None) -> Tuple[int, int]:
+        recipients = list(recipients)
+        sent = failed = 0
+
+        def guarded(recipient: Dict) -> bool:
+            if self._stopped.is_set():
+                return False
+            deliver(recipient)
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast') as executor:
+            futures = [executor.submit(guarded, recipient) for recipient in recipients]
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    if future.result():
+                        sent += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"Ошибка при отправке рассылки: {e}")
+                if progress:
+                    progress(done, len(recipients))
+        return sent, failed
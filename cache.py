@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        # Незавершённые загрузки: invalidate/clear снимают метку, и устаревший результат не сохраняется
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if not self.ttl or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def _store(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._loading.pop(key, None)
+            self._store(key, value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        # None тоже кэшируется: повторные запросы по несуществующим записям не идут в БД
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        token = object()
+        with self._lock:
+            self._loading[key] = token
+        try:
+            value = loader()
+        except BaseException:
+            with self._lock:
+                if self._loading.get(key) is token:
+                    del self._loading[key]
+            raise
+
+        with self._lock:
+            if self._loading.get(key) is token:
+                del self._loading[key]
+                self._store(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+            self._loading.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._loading.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
@@ -0,0 +1,93 @@
+import threading
+from typing import Dict, List, Optional
+
+from telebot import types
+
+ALL_GROUPS = "Все группы"
+
+
+def _reply_keyboard(*rows) -> str:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for row in rows:
+        markup.add(*row)
+    return markup.to_json()
+
+
+# Статичные меню сериализуются один раз при импорте
+ADMIN_MENU = _reply_keyboard(
+    ["📊 Экспорт в Excel"],
+    ["🚚 Добавить водителя", "🗑️ Удалить водителя"],
+    ["👥 Управление группами", "📋 Список водителей"],
+    ["📨 Создать рассылку"],
+)
+DRIVER_MENU = _reply_keyboard(["📋 Мои заказы"])
+EXPORT_MENU = _reply_keyboard(
+    ["📊 Пользователи Excel", "🔄 Пользователи: изменения"],
+    ["🚚 Водители Excel", "🔄 Водители: изменения"],
+    ["📄 Пользователи CSV", "📄 Водители CSV"],
+    ["⬅️ Назад"],
+)
+GROUP_MENU = _reply_keyboard(
+    ["➕ Добавить группу", "➖ Удалить группу"],
+    ["📋 Список групп", "⬅️ Назад"],
+)
+GROUP_DONE_MENU = _reply_keyboard(["👥 Управление группами", "⬅️ Назад"])
+CANCEL_MENU = _reply_keyboard(["❌ Отмена"])
+
+_contact_markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+_contact_markup.add(types.KeyboardButton("📱 Отправить контакт", request_contact=True))
+CONTACT_MENU = _contact_markup.to_json()
+
+
+def offer_price_keyboard(order_id: int) -> str:
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("💵 Предложить цену", callback_data=f"offer_price_{order_id}"))
+    return markup.to_json()
+
+
+class GroupCatalogue:
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            groups = tuple(self.db.get_all_groups())
+            names = [group['group_name'] for group in groups]
+            # Снимок заменяется одним присваиванием, читатели не берут блокировку
+            self._snapshot = {
+                'groups': groups,
+                'by_id': {group['group_id']: group for group in groups},
+                'by_name': {group['group_name']: group for group in groups},
+                'keyboard': _reply_keyboard(*[[name] for name in names]),
+                'broadcast_keyboard': _reply_keyboard(*[[name] for name in names], [ALL_GROUPS]),
+                'remove_keyboard': _reply_keyboard(*[[f"❌ {name}"] for name in names], ["⬅️ Назад"]),
+            }
+
+    def all(self) -> List[Dict]:
+        return [dict(group) for group in self._snapshot['groups']]
+
+    def get(self, group_id: int) -> Optional[Dict]:
+        group = self._snapshot['by_id'].get(group_id)
+        return dict(group) if group else None
+
+    def get_by_name(self, group_name: str) -> Optional[Dict]:
+        group = self._snapshot['by_name'].get(group_name)
+        return dict(group) if group else None
+
+    def name(self, group_id: int) -> Optional[str]:
+        group = self._snapshot['by_id'].get(group_id)
+        return group['group_name'] if group else None
+
+    def keyboard(self) -> str:
+        return self._snapshot['keyboard']
+
+    def broadcast_keyboard(self) -> str:
+        return self._snapshot['broadcast_keyboard']
+
+    def remove_keyboard(self) -> str:
+        return self._snapshot['remove_keyboard']
+
+    def __len__(self) -> int:
+        return len(self._snapshot['groups'])
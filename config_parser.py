@@ -1,11 +1,17 @@
 import json
 import os
-from typing import List, Optional
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional
 
 class ConfigParser:
-    def __init__(self, config_file='secrets.json'):
+    def __init__(self, config_file='secrets.json', reload_interval: float = 1.0):
         self.config_file = config_file
-        self.config = self._load_config()
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = self._stat_mtime()
+        self._next_check = time.monotonic() + reload_interval
+        self._apply(self._load_config())
     
     def _load_config(self):
         if not os.path.exists(self.config_file):
@@ -14,6 +20,50 @@ class ConfigParser:
         with open(self.config_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     
+    def _stat_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.config_file).st_mtime
+        except OSError:
+            return None
+    
+    def _apply(self, config: Dict[str, Any]):
+        admin_ids = set()
+        for admin_id in config.get('admin_ids', []):
+            try:
+                admin_ids.add(int(admin_id))
+            except (TypeError, ValueError):
+                print(f"❌ Некорректный admin_id в конфигурации: {admin_id}")
+        # Наборы для проверки прав считаются один раз на загрузку конфигурации
+        self._admin_ids: FrozenSet[int] = frozenset(admin_ids)
+        self._admin_usernames: FrozenSet[str] = frozenset(
+            username.lower().lstrip('@') for username in config.get('admin_usernames', []) if username
+        )
+        self.config = config
+    
+    def reload(self, force: bool = False) -> bool:
+        with self._lock:
+            mtime = self._stat_mtime()
+            if not force and mtime == self._mtime:
+                return False
+            try:
+                config = self._load_config()
+            except (OSError, ValueError) as e:
+                # Остаёмся на прежней конфигурации, пока файл не исправят
+                print(f"❌ Не удалось перечитать {self.config_file}: {e}")
+                self._mtime = mtime
+                return False
+            self._mtime = mtime
+            self._apply(config)
+        print(f"✅ Конфигурация {self.config_file} перечитана")
+        return True
+    
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        self.reload()
+    
     def get_bot_token(self) -> Optional[str]:
         return self.config.get('bot_token')
     
@@ -32,7 +82,95 @@ class ConfigParser:
                 return None
         return group_id
     
+    def get_db_name(self) -> str:
+        return self.config.get('db_name', 'db.sqlite3')
+    
+    def get_db_pool_size(self) -> int:
+        return int(self.config.get('db_pool_size', 5))
+    
+    def get_db_profile(self) -> str:
+        return self.config.get('db_profile', 'durable')
+    
+    def get_db_pragmas(self) -> Dict[str, Any]:
+        return self.config.get('db_pragmas', {})
+    
+    def get_cache_size(self) -> int:
+        return int(self.config.get('cache_size', 1024))
+    
+    def get_cache_ttl(self) -> float:
+        return float(self.config.get('cache_ttl', 300))
+    
+    def get_export_csv_gzip(self) -> bool:
+        return bool(self.config.get('export_csv_gzip', False))
+    
+    def get_job_workers(self) -> int:
+        return int(self.config.get('job_workers', 2))
+    
+    def get_job_queue_size(self) -> int:
+        return int(self.config.get('job_queue_size', 10))
+    
+    def get_broadcast_workers(self) -> int:
+        return int(self.config.get('broadcast_workers', 8))
+    
+    def get_broadcast_rate(self) -> float:
+        return float(self.config.get('broadcast_rate', 30))
+    
+    def get_broadcast_busy_hours(self) -> float:
+        return float(self.config.get('broadcast_busy_hours', 0))
+    
+    def get_broadcast_inactive_days(self) -> float:
+        return float(self.config.get('broadcast_inactive_days', 0))
+    
+    def get_broadcast_max_attempts(self) -> int:
+        return int(self.config.get('broadcast_max_attempts', 5))
+    
+    def get_session_backend(self) -> str:
+        return self.config.get('session_backend', 'sqlite')
+    
+    def get_session_max_entries(self) -> int:
+        return int(self.config.get('session_max_entries', 10000))
+    
+    def get_session_ttl(self) -> float:
+        return float(self.config.get('session_ttl', 86400))
+    
+    def get_update_mode(self) -> str:
+        return self.config.get('update_mode', 'polling')
+    
+    def get_webhook_url(self) -> Optional[str]:
+        return self.config.get('webhook_url')
+    
+    def get_webhook_secret(self) -> Optional[str]:
+        return self.config.get('webhook_secret')
+    
+    def get_webhook_host(self) -> str:
+        return self.config.get('webhook_host', '0.0.0.0')
+    
+    def get_webhook_port(self) -> int:
+        return int(self.config.get('webhook_port', 8443))
+    
+    def get_webhook_path(self) -> str:
+        return self.config.get('webhook_path', '/webhook')
+    
+    def get_update_shards(self) -> int:
+        return int(self.config.get('update_shards', 4))
+    
+    def get_update_queue_size(self) -> int:
+        return int(self.config.get('update_queue_size', 100))
+    
     def is_admin(self, user_id: int, username: str) -> bool:
-        username = username.lower() if username else ""
-        return (user_id in self.get_admin_ids() or 
-                username in [u.lower() for u in self.get_admin_usernames()])
\ No newline at end of file
+        self.maybe_reload()
+        return (user_id in self._admin_ids or 
+                bool(username) and username.lower() in self._admin_usernames)
+
+
+_instances: Dict[str, ConfigParser] = {}
+_instances_lock = threading.Lock()
+
+
+def get_config(config_file: str = 'secrets.json') -> ConfigParser:
+    # Один разобранный конфиг на процесс для каждого файла
+    with _instances_lock:
+        config = _instances.get(config_file)
+        if config is None:
+            config = _instances[config_file] = ConfigParser(config_file)
+        return config
\ No newline at end of file
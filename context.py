@@ -0,0 +1,42 @@
+from typing import Dict, Optional
+
+from cache import MISSING
+
+
+class UpdateContext:
+    def __init__(self, backend, config, from_user):
+        self.backend = backend
+        self.config = config
+        self.user_id = from_user.id
+        self.username = from_user.username
+        self._user = MISSING
+        self._driver = MISSING
+        self._is_admin = MISSING
+
+    def invalidate(self):
+        # После записи в users/drivers строки перечитываются при следующем обращении
+        self._user = MISSING
+        self._driver = MISSING
+
+    @property
+    def user(self) -> Optional[Dict]:
+        if self._user is MISSING:
+            self._user = self.backend.get_user(self.user_id)
+        return self._user
+
+    @property
+    def role(self) -> Optional[str]:
+        user = self.user
+        return user.get('role') if user else None
+
+    @property
+    def driver(self) -> Optional[Dict]:
+        if self._driver is MISSING:
+            self._driver = self.backend.get_driver_info(self.user_id)
+        return self._driver
+
+    @property
+    def is_admin(self) -> bool:
+        if self._is_admin is MISSING:
+            self._is_admin = self.config.is_admin(self.user_id, self.username)
+        return self._is_admin
@@ -1,113 +1,518 @@
 import sqlite3
 import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+
+DB_PROFILES = {
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -16000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+        'optimize_interval': 3600,
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'optimize_interval': 3600,
+    },
+}
+
+PRAGMA_NAMES = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'busy_timeout')
+
+
+def resolve_profile(name: str = 'durable', overrides: Optional[Dict] = None) -> Dict[str, Any]:
+    if name not in DB_PROFILES:
+        raise ValueError(f"Unknown database profile '{name}', expected one of {sorted(DB_PROFILES)}")
+    profile = dict(DB_PROFILES[name])
+    profile.update(overrides or {})
+    return profile
+
+
+VERSIONED_TABLES = ('users', 'drivers', 'groups')
+
+# Столбцы с данными: UPDATE, который их не меняет, не считается изменением строки
+TRACKED_COLUMNS = {
+    'users': ('username', 'first_name', 'last_name', 'phone', 'role'),
+    'drivers': ('full_name', 'phone', 'group_id'),
+    'groups': ('group_name',),
+}
+
+
+def _changed(table: str) -> str:
+    return " OR ".join(f"NEW.{column} IS NOT OLD.{column}" for column in TRACKED_COLUMNS[table])
+
+# Миграции схемы: индекс в списке + 1 = значение PRAGMA user_version после применения
+MIGRATIONS = [
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_name TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS drivers (
+            user_id INTEGER PRIMARY KEY,
+            full_name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            group_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (group_id) REFERENCES groups (group_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            group_id INTEGER,
+            photos TEXT,
+            topic_name TEXT,
+            topic_id INTEGER,  -- ID топика в группе
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (admin_id) REFERENCES users (user_id),
+            FOREIGN KEY (group_id) REFERENCES groups (group_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS driver_offers (
+            offer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            driver_id INTEGER NOT NULL,
+            price REAL NOT NULL,
+            comment TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES orders (order_id),
+            FOREIGN KEY (driver_id) REFERENCES drivers (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS order_responses (
+            response_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            driver_id INTEGER NOT NULL,
+            accepted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES orders (order_id),
+            FOREIGN KEY (driver_id) REFERENCES drivers (user_id),
+            UNIQUE(order_id, driver_id)
+        )
+        ''',
+    ],
+    [
+        "CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)",
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)",
+        "CREATE INDEX IF NOT EXISTS idx_drivers_group_id ON drivers (group_id)",
+        "CREATE INDEX IF NOT EXISTS idx_driver_offers_order_driver ON driver_offers (order_id, driver_id)",
+        "CREATE INDEX IF NOT EXISTS idx_order_responses_order_id ON order_responses (order_id)",
+        "CREATE INDEX IF NOT EXISTS idx_order_responses_driver_id ON order_responses (driver_id)",
+    ],
+    [
+        # Заказ закрепляется не более чем за одним водителем
+        """DELETE FROM order_responses WHERE response_id NOT IN (
+               SELECT MIN(response_id) FROM order_responses GROUP BY order_id
+           )""",
+        "DROP INDEX IF EXISTS idx_order_responses_order_id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_order_responses_order_unique ON order_responses (order_id)",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed, interrupted
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)",
+    ],
+    [
+        # Счётчики изменений таблиц, поддерживаются триггерами
+        """CREATE TABLE IF NOT EXISTS data_versions (
+               name TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           )""",
+        *[f"INSERT OR IGNORE INTO data_versions (name) VALUES ('{table}')" for table in VERSIONED_TABLES],
+        *[
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END"""
+            for table in VERSIONED_TABLES
+            for event in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+    ],
+    [
+        # updated_at с миллисекундами, поддерживается триггерами
+        *[
+            statement
+            for table, key in (('users', 'user_id'), ('drivers', 'user_id'))
+            for statement in (
+                f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP",
+                f"UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', COALESCE(created_at, 'now'))",
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)",
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_insert_updated_at AFTER INSERT ON {table}
+                    BEGIN
+                        UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE {key} = NEW.{key};
+                    END""",
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_update_updated_at AFTER UPDATE ON {table}
+                    WHEN NEW.updated_at IS OLD.updated_at
+                    BEGIN
+                        UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE {key} = NEW.{key};
+                    END""",
+            )
+        ],
+        """CREATE TABLE IF NOT EXISTS export_watermarks (
+               kind TEXT PRIMARY KEY,
+               exported_at TEXT NOT NULL
+           )""",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            driver_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending, sent, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES orders (order_id),
+            UNIQUE(order_id, driver_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_outbox_status ON broadcast_outbox (status, order_id)",
+    ],
+    [
+        # Отдельная таблица, чтобы отметки активности не меняли updated_at и версии users
+        """CREATE TABLE IF NOT EXISTS user_activity (
+               user_id INTEGER PRIMARY KEY,
+               last_seen_at TIMESTAMP NOT NULL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_order_responses_driver_accepted ON order_responses (driver_id, accepted_at)",
+    ],
+    [
+        """CREATE TABLE IF NOT EXISTS sessions (
+               namespace TEXT NOT NULL,
+               session_key TEXT NOT NULL,
+               value TEXT NOT NULL,
+               expires_at REAL NOT NULL,
+               PRIMARY KEY (namespace, session_key)
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (namespace, expires_at)",
+    ],
+    [
+        # Повторный /start и импорт без изменений не должны сдвигать версию и updated_at
+        *[
+            statement
+            for table in VERSIONED_TABLES
+            for statement in (
+                f"DROP TRIGGER IF EXISTS trg_{table}_update_version",
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_update_version AFTER UPDATE ON {table}
+                    WHEN {_changed(table)}
+                    BEGIN
+                        UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                    END""",
+            )
+        ],
+        *[
+            statement
+            for table, key in (('users', 'user_id'), ('drivers', 'user_id'))
+            for statement in (
+                f"DROP TRIGGER IF EXISTS trg_{table}_update_updated_at",
+                f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_update_updated_at AFTER UPDATE ON {table}
+                    WHEN NEW.updated_at IS OLD.updated_at AND ({_changed(table)})
+                    BEGIN
+                        UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE {key} = NEW.{key};
+                    END""",
+            )
+        ],
+    ],
+]
+
+
+class ConnectionPool:
+    def __init__(self, db_name: str, size: int = 5, timeout: float = 30.0, pragmas: Optional[Dict] = None):
+        self.db_name = db_name
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.pragmas = {k: v for k, v in (pragmas or {}).items() if k in PRAGMA_NAMES}
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._lock = threading.Lock()
+        # Соединение, выданное текущему потоку, и глубина вложенности
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No free database connection after {self.timeout}s")
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def dedicated(self):
+        # Соединение в обход привязки к потоку: записи этого потока идут через другое соединение
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._release(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
 
 class Database:
-    def __init__(self, db_name='db.sqlite3'):
+    def __init__(self, db_name='db.sqlite3', pool_size: int = 5, profile: Optional[Dict] = None):
         self.db_name = db_name
+        self.profile = profile if profile is not None else resolve_profile()
+        self.pool = ConnectionPool(db_name, pool_size, pragmas=self.profile)
+        self.optimize_interval = self.profile.get('optimize_interval', 0)
+        self._next_optimize = time.monotonic() + self.optimize_interval
+        self._optimize_lock = threading.Lock()
+        self._tx = threading.local()
         self._init_db()
+        with self.pool.connection() as conn:
+            # Собираем статистику для планировщика, если её ещё нет
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+                conn.execute("ANALYZE")
+                conn.commit()
+    
+    def close(self):
+        self.optimize()
+        self.pool.close()
+    
+    def optimize(self):
+        with self.pool.connection() as conn:
+            conn.execute("PRAGMA optimize")
+        self._next_optimize = time.monotonic() + self.optimize_interval
+    
+    def _maybe_optimize(self):
+        if not self.optimize_interval or time.monotonic() < self._next_optimize:
+            return
+        if not self._optimize_lock.acquire(blocking=False):
+            return
+        try:
+            self.optimize()
+        finally:
+            self._optimize_lock.release()
     
     def _init_db(self):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    phone TEXT,
-                    role TEXT DEFAULT 'user',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS groups (
-                    group_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_name TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+        with self.pool.connection() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS drivers (
-                    user_id INTEGER PRIMARY KEY,
-                    full_name TEXT NOT NULL,
-                    phone TEXT NOT NULL,
-                    group_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (group_id) REFERENCES groups (group_id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS orders (
-                    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    admin_id INTEGER NOT NULL,
-                    description TEXT NOT NULL,
-                    group_id INTEGER,
-                    photos TEXT,
-                    topic_name TEXT,
-                    topic_id INTEGER,  -- ID топика в группе
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (admin_id) REFERENCES users (user_id),
-                    FOREIGN KEY (group_id) REFERENCES groups (group_id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS driver_offers (
-                    offer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    driver_id INTEGER NOT NULL,
-                    price REAL NOT NULL,
-                    comment TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (order_id) REFERENCES orders (order_id),
-                    FOREIGN KEY (driver_id) REFERENCES drivers (user_id)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS order_responses (
-                    response_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    driver_id INTEGER NOT NULL,
-                    accepted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (order_id) REFERENCES orders (order_id),
-                    FOREIGN KEY (driver_id) REFERENCES drivers (user_id),
-                    UNIQUE(order_id, driver_id)
-                )
-            ''')
+            for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    # Версию перечитываем под блокировкой: другой процесс мог уже мигрировать
+                    if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                        conn.rollback()
+                        continue
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {number}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+    
+    def _in_transaction(self) -> bool:
+        return getattr(self._tx, 'depth', 0) > 0
+    
+    @contextmanager
+    def transaction(self):
+        with self.pool.connection() as conn:
+            if self._in_transaction():
+                self._tx.depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._tx.depth -= 1
+                return
             
-            conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            self._tx.depth = 1
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._tx.depth = 0
+        self._maybe_optimize()
     
     def execute(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
-        with sqlite3.connect(self.db_name) as conn:
+        if self._in_transaction():
+            with self.pool.connection() as conn:
+                return conn.execute(query, params)
+        
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
-            return cursor
+            try:
+                cursor.execute(query, params)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self._maybe_optimize()
+        return cursor
     
     def fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict]:
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
             result = cursor.fetchone()
             return dict(result) if result else None
     
     def fetch_all(self, query: str, params: tuple = ()) -> List[Dict]:
-        with sqlite3.connect(self.db_name) as conn:
-            conn.row_factory = sqlite3.Row
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
     
+    def iter_rows(self, query: str, params: tuple = (), chunk_size: int = 1000) -> Iterator[Dict]:
+        # Курсор держит отдельное соединение, пока генератор не будет исчерпан или закрыт:
+        # записи в том же потоке (прогресс задачи) не упираются в устаревший снимок чтения
+        with self.pool.dedicated() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+    
+    def execute_many(self, query: str, rows: Iterable[tuple], chunk_size: int = 500) -> int:
+        # Все пачки пишутся в одной транзакции: один commit на весь набор
+        total = 0
+        rows = iter(rows)
+        with self.transaction() as conn:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                cursor = conn.executemany(query, chunk)
+                total += cursor.rowcount
+        return total
+    
+    def upsert_users(self, users: Iterable[Dict], chunk_size: int = 500) -> int:
+        return self.execute_many(
+            """INSERT INTO users (user_id, username, first_name, last_name, phone, role)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET
+                   username = excluded.username,
+                   first_name = excluded.first_name,
+                   last_name = excluded.last_name,
+                   phone = COALESCE(excluded.phone, users.phone)""",
+            ((u['user_id'], u.get('username'), u.get('first_name'), u.get('last_name'),
+              u.get('phone'), u.get('role', 'user')) for u in users),
+            chunk_size
+        )
+    
+    def upsert_drivers(self, drivers: Iterable[Dict], chunk_size: int = 500) -> int:
+        drivers = list(drivers)
+        with self.transaction():
+            count = self.execute_many(
+                """INSERT INTO drivers (user_id, full_name, phone, group_id)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       full_name = excluded.full_name,
+                       phone = excluded.phone,
+                       group_id = excluded.group_id""",
+                ((d['user_id'], d['full_name'], d['phone'], d.get('group_id')) for d in drivers),
+                chunk_size
+            )
+            self.execute_many(
+                "UPDATE users SET role = 'driver' WHERE user_id = ?",
+                ((d['user_id'],) for d in drivers),
+                chunk_size
+            )
+        return count
+    
     def add_user(self, user_id: int, username: str, first_name: str, last_name: str, phone: str = None, role: str = 'user'):
         self.execute(
             "INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, phone, role) VALUES (?, ?, ?, ?, ?, ?)",
@@ -127,15 +532,9 @@ class Database:
         return self.fetch_all("SELECT * FROM users")
     
     def add_driver(self, user_id: int, full_name: str, phone: str, group_id: int):
-        user = self.get_user(user_id)
-        if not user:
-            pass
-        
-        self.execute(
-            "INSERT OR REPLACE INTO drivers (user_id, full_name, phone, group_id) VALUES (?, ?, ?, ?)",
-            (user_id, full_name, phone, group_id)
-        )
-        self.execute("UPDATE users SET role = 'driver' WHERE user_id = ?", (user_id,))
+        self.upsert_drivers([
+            {'user_id': user_id, 'full_name': full_name, 'phone': phone, 'group_id': group_id}
+        ])
     
     def get_driver(self, user_id: int) -> Optional[Dict]:
         return self.fetch_one(
@@ -151,6 +550,82 @@ class Database:
             "SELECT d.*, u.username FROM drivers d JOIN users u ON d.user_id = u.user_id"
         )
 
+    DRIVERS_WITH_GROUPS_QUERY = """SELECT d.*, u.username, g.group_name
+               FROM drivers d
+               JOIN users u ON d.user_id = u.user_id
+               LEFT JOIN groups g ON d.group_id = g.group_id"""
+    
+    CHANGED_DRIVERS_FILTER = """ WHERE d.user_id IN (
+                   SELECT user_id FROM drivers WHERE updated_at > ?
+                   UNION
+                   SELECT user_id FROM users WHERE updated_at > ?
+               )"""
+    
+    def count_export_rows(self, kind: str, since: str = None) -> int:
+        if kind == 'users':
+            if since:
+                row = self.fetch_one("SELECT COUNT(*) AS total FROM users WHERE updated_at > ?", (since,))
+            else:
+                row = self.fetch_one("SELECT COUNT(*) AS total FROM users")
+        else:
+            query = "SELECT COUNT(*) AS total FROM drivers d JOIN users u ON d.user_id = u.user_id"
+            if since:
+                row = self.fetch_one(query + self.CHANGED_DRIVERS_FILTER, (since, since))
+            else:
+                row = self.fetch_one(query)
+        return row['total']
+    
+    @staticmethod
+    def _keyset(key: str, filtered: bool, after_id: int = None, before_id: int = None) -> tuple:
+        # Постраничное чтение по ключу: строки до after_id не перебираются,
+        # before_id читает предыдущую страницу в обратном порядке
+        joiner = " AND" if filtered else " WHERE"
+        if before_id is not None:
+            return f"{joiner} {key} < ? ORDER BY {key} DESC", (before_id,)
+        if after_id is not None:
+            return f"{joiner} {key} > ? ORDER BY {key}", (after_id,)
+        return f" ORDER BY {key}", ()
+    
+    def iter_users(self, chunk_size: int = 1000, since: str = None,
+                   after_id: int = None, before_id: int = None) -> Iterator[Dict]:
+        query, params = "SELECT * FROM users", ()
+        if since:
+            query, params = query + " WHERE updated_at > ?", (since,)
+        keyset, keyset_params = self._keyset("user_id", bool(since), after_id, before_id)
+        return self.iter_rows(query + keyset, params + keyset_params, chunk_size)
+    
+    def iter_drivers_with_groups(self, chunk_size: int = 1000, since: str = None,
+                                 after_id: int = None, before_id: int = None) -> Iterator[Dict]:
+        query, params = self.DRIVERS_WITH_GROUPS_QUERY, ()
+        if since:
+            query, params = query + self.CHANGED_DRIVERS_FILTER, (since, since)
+        keyset, keyset_params = self._keyset("d.user_id", bool(since), after_id, before_id)
+        return self.iter_rows(query + keyset, params + keyset_params, chunk_size)
+    
+    def get_last_update(self, kind: str) -> Optional[str]:
+        if kind == 'users':
+            row = self.fetch_one("SELECT MAX(updated_at) AS last_update FROM users")
+        else:
+            row = self.fetch_one(
+                """SELECT MAX(last_update) AS last_update FROM (
+                       SELECT MAX(updated_at) AS last_update FROM drivers
+                       UNION ALL
+                       SELECT MAX(updated_at) FROM users
+                   )"""
+            )
+        return row['last_update']
+    
+    def get_export_watermark(self, kind: str) -> Optional[str]:
+        row = self.fetch_one("SELECT exported_at FROM export_watermarks WHERE kind = ?", (kind,))
+        return row['exported_at'] if row else None
+    
+    def set_export_watermark(self, kind: str, exported_at: str):
+        self.execute(
+            """INSERT INTO export_watermarks (kind, exported_at) VALUES (?, ?)
+               ON CONFLICT(kind) DO UPDATE SET exported_at = excluded.exported_at""",
+            (kind, exported_at)
+        )
+
     def add_order(self, admin_id: int, description: str, group_id: int, photos: List[str], topic_name: str = None, topic_id: int = None) -> int:
         photos_json = json.dumps(photos)
         cursor = self.execute(
@@ -181,26 +656,34 @@ class Database:
             (order_id,)
         )
     
-    def accept_driver_offer(self, offer_id: int):
-        # Получаем информацию о предложении
-        offer = self.fetch_one("SELECT * FROM driver_offers WHERE offer_id = ?", (offer_id,))
-        if not offer:
-            return False
-        
-        # Добавляем водителя к заказу
-        self.execute(
-            "INSERT INTO order_responses (order_id, driver_id) VALUES (?, ?)",
-            (offer['order_id'], offer['driver_id'])
-        )
-        
-        # Удаляем остальные предложения для этого заказа
-        self.execute(
-            "DELETE FROM driver_offers WHERE order_id = ? AND offer_id != ?",
-            (offer['order_id'], offer_id)
-        )
+    def accept_driver_offer(self, order_id: int, driver_id: int) -> bool:
+        with self.transaction():
+            # Закрепляем заказ одной условной вставкой: уникальный индекс по order_id
+            # гарантирует, что выиграет ровно один вызов
+            cursor = self.execute(
+                """INSERT OR IGNORE INTO order_responses (order_id, driver_id)
+                   SELECT order_id, driver_id FROM driver_offers
+                   WHERE order_id = ? AND driver_id = ? LIMIT 1""",
+                (order_id, driver_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            
+            # Удаляем остальные предложения для этого заказа
+            self.execute(
+                "DELETE FROM driver_offers WHERE order_id = ? AND driver_id != ?",
+                (order_id, driver_id)
+            )
         
         return True
     
+    def add_order_response(self, order_id: int, driver_id: int) -> bool:
+        cursor = self.execute(
+            "INSERT OR IGNORE INTO order_responses (order_id, driver_id) VALUES (?, ?)",
+            (order_id, driver_id)
+        )
+        return cursor.rowcount == 1
+    
     def get_order_responses(self, order_id: int) -> List[Dict]:
         return self.fetch_all(
             """SELECT r.*, d.full_name, d.phone, u.username 
@@ -247,8 +730,156 @@ class Database:
             (group_id, user_id)
         )
 
+    def get_group_driver_counts(self) -> List[Dict]:
+        return self.fetch_all(
+            """SELECT g.group_id, g.group_name, COUNT(d.user_id) AS drivers_count
+               FROM groups g
+               LEFT JOIN drivers d ON d.group_id = g.group_id
+               GROUP BY g.group_id
+               ORDER BY g.group_name"""
+        )
+
     def get_drivers_by_group(self, group_id: int) -> List[Dict]:
         return self.fetch_all(
             "SELECT d.*, u.username FROM drivers d JOIN users u ON d.user_id = u.user_id WHERE d.group_id = ?",
             (group_id,)
-        )
\ No newline at end of file
+        )
+
+    def create_job(self, kind: str, created_by: int = None) -> int:
+        cursor = self.execute(
+            "INSERT INTO jobs (kind, created_by) VALUES (?, ?)",
+            (kind, created_by)
+        )
+        return cursor.lastrowid
+
+    def update_job(self, job_id: int, status: str = None, progress: int = None, total: int = None,
+                   error: str = None, finished: bool = False):
+        fields, params = [], []
+        for column, value in (('status', status), ('progress', progress), ('total', total), ('error', error)):
+            if value is not None:
+                fields.append(f"{column} = ?")
+                params.append(value)
+        if finished:
+            fields.append("finished_at = CURRENT_TIMESTAMP")
+        if not fields:
+            return
+        self.execute(f"UPDATE jobs SET {', '.join(fields)} WHERE job_id = ?", (*params, job_id))
+
+    def interrupt_unfinished_jobs(self) -> int:
+        cursor = self.execute(
+            "UPDATE jobs SET status = 'interrupted', finished_at = CURRENT_TIMESTAMP WHERE status IN ('queued', 'running')"
+        )
+        return cursor.rowcount
+
+    def get_data_versions(self, tables: Iterable[str] = VERSIONED_TABLES) -> Dict[str, int]:
+        tables = tuple(tables)
+        rows = self.fetch_all(
+            f"SELECT name, version FROM data_versions WHERE name IN ({', '.join('?' for _ in tables)})",
+            tables
+        )
+        return {row['name']: row['version'] for row in rows}
+
+    def get_pending_deliveries(self, order_id: int) -> List[Dict]:
+        return self.fetch_all(
+            "SELECT * FROM broadcast_outbox WHERE status = 'pending' AND order_id = ? ORDER BY outbox_id",
+            (order_id,)
+        )
+
+    def get_orders_with_pending_deliveries(self) -> List[int]:
+        rows = self.fetch_all("SELECT DISTINCT order_id FROM broadcast_outbox WHERE status = 'pending' ORDER BY order_id")
+        return [row['order_id'] for row in rows]
+
+    def mark_delivery_sent(self, outbox_id: int):
+        self.execute(
+            """UPDATE broadcast_outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL,
+                   updated_at = CURRENT_TIMESTAMP
+               WHERE outbox_id = ?""",
+            (outbox_id,)
+        )
+
+    def mark_delivery_failed(self, outbox_id: int, error: str, retry: bool = False, max_attempts: int = 1):
+        # Временный сбой оставляет доставку в 'pending', пока не исчерпаны попытки: её повторит возобновление
+        self.execute(
+            """UPDATE broadcast_outbox SET
+                   status = CASE WHEN ? AND attempts + 1 < ? THEN 'pending' ELSE 'failed' END,
+                   attempts = attempts + 1, last_error = ?, updated_at = CURRENT_TIMESTAMP
+               WHERE outbox_id = ?""",
+            (retry, max_attempts, error, outbox_id)
+        )
+
+    def touch_user(self, user_id: int):
+        self.execute(
+            """INSERT INTO user_activity (user_id, last_seen_at) VALUES (?, CURRENT_TIMESTAMP)
+               ON CONFLICT(user_id) DO UPDATE SET last_seen_at = excluded.last_seen_at""",
+            (user_id,)
+        )
+
+    def enqueue_audience(self, order_id: int, group_ids: Optional[List[int]] = None,
+                         busy_hours: float = 0, inactive_days: float = 0) -> int:
+        # Получатели вычисляются и сохраняются в outbox одним запросом
+        conditions = []
+        params = [order_id]
+        if group_ids is not None:
+            if not group_ids:
+                return 0
+            conditions.append(f"d.group_id IN ({', '.join('?' * len(group_ids))})")
+            params.extend(group_ids)
+        if busy_hours:
+            conditions.append(
+                """NOT EXISTS (
+                       SELECT 1 FROM order_responses r
+                       WHERE r.driver_id = d.user_id AND r.accepted_at >= datetime('now', ?)
+                   )"""
+            )
+            params.append(f"-{float(busy_hours)} hours")
+        if inactive_days:
+            # Без отметки активности ориентируемся на дату регистрации водителя
+            conditions.append(
+                """COALESCE(
+                       (SELECT a.last_seen_at FROM user_activity a WHERE a.user_id = d.user_id),
+                       d.created_at
+                   ) >= datetime('now', ?)"""
+            )
+            params.append(f"-{float(inactive_days)} days")
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.execute(
+            f"""INSERT OR IGNORE INTO broadcast_outbox (order_id, driver_id)
+                SELECT ?, d.user_id FROM drivers d {where}
+                ORDER BY d.user_id""",
+            params
+        )
+        return cursor.rowcount
+
+    def get_session(self, namespace: str, key: str, now: float) -> Optional[Dict]:
+        return self.fetch_one(
+            "SELECT value, expires_at FROM sessions WHERE namespace = ? AND session_key = ? AND expires_at > ?",
+            (namespace, key, now)
+        )
+
+    def save_sessions(self, rows: List[tuple], namespace: str, deleted: List[str]):
+        with self.transaction():
+            if rows:
+                self.execute_many(
+                    """INSERT INTO sessions (namespace, session_key, value, expires_at) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(namespace, session_key) DO UPDATE SET
+                           value = excluded.value, expires_at = excluded.expires_at""",
+                    rows
+                )
+            if deleted:
+                self.execute_many(
+                    "DELETE FROM sessions WHERE namespace = ? AND session_key = ?",
+                    ((namespace, key) for key in deleted)
+                )
+
+    def purge_sessions(self, namespace: str, now: float, max_entries: int):
+        with self.transaction():
+            self.execute("DELETE FROM sessions WHERE namespace = ? AND expires_at <= ?", (namespace, now))
+            # Сверх лимита удаляются сессии, которые истекут раньше остальных
+            self.execute(
+                """DELETE FROM sessions WHERE namespace = ? AND session_key IN (
+                       SELECT session_key FROM sessions WHERE namespace = ?
+                       ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                   )""",
+                (namespace, namespace, max_entries)
+            )
\ No newline at end of file
@@ -0,0 +1,93 @@
+import queue
+import threading
+from typing import Iterable, List
+
+UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'channel_post', 'edited_channel_post',
+    'inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+    'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+# Виды обновлений, для которых у бота есть обработчики, и методы telebot, которые их обрабатывают
+UPDATE_HANDLERS = (
+    ('message', 'process_new_messages'),
+    ('edited_message', 'process_new_edited_messages'),
+    ('callback_query', 'process_new_callback_query'),
+)
+
+
+def update_key(update) -> int:
+    # Состояния диалогов хранятся по user_id, поэтому шард выбирается по отправителю
+    for field in UPDATE_FIELDS:
+        payload = getattr(update, field, None)
+        if payload is None:
+            continue
+        user = getattr(payload, 'from_user', None) or getattr(payload, 'user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(payload, 'chat', None)
+        if chat is not None:
+            return chat.id
+    return update.update_id
+
+
+class ShardedDispatcher:
+    def __init__(self, bot, shards: int = 4, queue_size: int = 100):
+        self.bot = bot
+        self._offset_lock = threading.Lock()
+        self._queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(max(1, shards))]
+        self._workers = [
+            threading.Thread(target=self._work, args=(shard,), name=f'updates-{number}', daemon=True)
+            for number, shard in enumerate(self._queues)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _shard(self, update) -> queue.Queue:
+        return self._queues[update_key(update) % len(self._queues)]
+
+    def _advance_offset(self, update):
+        # Смещение getUpdates сдвигается в потоке опроса до постановки в очередь,
+        # иначе следующий запрос вернёт ещё не обработанные обновления повторно
+        with self._offset_lock:
+            if update.update_id > self.bot.last_update_id:
+                self.bot.last_update_id = update.update_id
+
+    def submit(self, update, block: bool = True) -> bool:
+        self._advance_offset(update)
+        try:
+            self._shard(update).put(update, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def submit_all(self, updates: Iterable):
+        for update in updates:
+            self.submit(update)
+
+    def depths(self) -> List[int]:
+        return [shard.qsize() for shard in self._queues]
+
+    def _work(self, shard: queue.Queue):
+        while True:
+            update = shard.get()
+            if update is None:
+                return
+            try:
+                self._handle(update)
+            except Exception as e:
+                print(f"❌ Ошибка при обработке обновления {update.update_id}: {e}")
+
+    def _handle(self, update):
+        # Только обработка: смещение уже сдвинуто в submit, process_new_updates здесь не вызывается
+        for field, method in UPDATE_HANDLERS:
+            payload = getattr(update, field, None)
+            if payload is not None:
+                getattr(self.bot, method)([payload])
+
+    def stop(self):
+        # Метка остановки встаёт в конец очереди: всё, что уже принято, будет обработано
+        for shard in self._queues:
+            shard.put(None)
+        for worker in self._workers:
+            worker.join()
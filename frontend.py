@@ -1,52 +1,91 @@
 from telebot import TeleBot, types
 from backend import Backend
-from config_parser import ConfigParser
+from jobs import JobRunner
+from broadcast import BroadcastEngine
+from sessions import create_session_store
+from context import UpdateContext
+from catalogue import (
+    ADMIN_MENU, ALL_GROUPS, CANCEL_MENU, CONTACT_MENU, DRIVER_MENU, EXPORT_MENU, GROUP_DONE_MENU, GROUP_MENU,
+    offer_price_keyboard
+)
+from config_parser import get_config
 from typing import List, Dict, Any
 import json
 from datetime import datetime
-import os
 
 class Frontend:
     def __init__(self, bot: TeleBot):
         self.bot = bot
         self.backend = Backend()
-        self.config = ConfigParser()
-        self.admin_ids = self.config.get_admin_ids()
+        self.config = get_config()
         self.group_id = self.config.get_group_id()
+        self.jobs = JobRunner(self.backend.db, self.config.get_job_workers(), self.config.get_job_queue_size())
+        self.dispatcher = None
+        self.broadcaster = BroadcastEngine(
+            workers=self.config.get_broadcast_workers(),
+            global_rate=self.config.get_broadcast_rate()
+        )
         
-        self.user_states = {}
-        self.temp_data = {}
+        session_backend = self.config.get_session_backend()
+        session_max_entries = self.config.get_session_max_entries()
+        session_ttl = self.config.get_session_ttl()
+        self.user_states = create_session_store(
+            session_backend, self.backend.db, 'states', session_max_entries, session_ttl
+        )
+        self.temp_data = create_session_store(
+            session_backend, self.backend.db, 'data', session_max_entries, session_ttl
+        )
+
+        self.admin_commands = {
+            "📊 Экспорт в Excel": lambda message, ctx: self._handle_export_excel(message),
+            "🚚 Добавить водителя": self._start_add_driver,
+            "📨 Создать рассылку": self._start_create_broadcast,
+            "📋 Список водителей": lambda message, ctx: self._handle_export_drivers(message),
+            "🗑️ Удалить водителя": self._start_remove_driver,
+            "👥 Управление группами": lambda message, ctx: self._handle_group_management(message),
+            "➕ Добавить группу": self._start_add_group,
+            "➖ Удалить группу": self._handle_remove_group,
+            "📋 Список групп": self._handle_list_groups,
+            "⬅️ Назад": lambda message, ctx: self._show_admin_menu(message),
+        }
+        self.export_commands = {
+            "📊 Пользователи Excel": self._export_users_excel,
+            "🚚 Водители Excel": self._export_drivers_excel,
+            "📄 Пользователи CSV": lambda message: self._send_export(message, 'users', self._csv_format()),
+            "📄 Водители CSV": lambda message: self._send_export(message, 'drivers', self._csv_format()),
+            "🔄 Пользователи: изменения": lambda message: self._send_changes_export(message, 'users'),
+            "🔄 Водители: изменения": lambda message: self._send_changes_export(message, 'drivers'),
+            "⬅️ Назад": self._show_admin_menu,
+        }
 
     def clear_user_state(self, user_id: int):
-        if user_id in self.user_states:
-            del self.user_states[user_id]
-        if user_id in self.temp_data:
-            del self.temp_data[user_id]
+        self.user_states.delete(user_id)
+        self.temp_data.delete(user_id)
     
     def is_admin(self, user_id: int, username: str) -> bool:
         return self.config.is_admin(user_id, username)
     
-    def handle_start(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def context(self, update) -> UpdateContext:
+        return UpdateContext(self.backend, self.config, update.from_user)
+    
+    def handle_start(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
+        username = ctx.username
         first_name = message.from_user.first_name
         last_name = message.from_user.last_name or ""
         
         self.clear_user_state(user_id)
         
         self.backend.register_user(user_id, username, first_name, last_name)
+        ctx.invalidate()
 
-        if self.is_admin(user_id, username):
-            self.backend.db.execute(
-                "UPDATE users SET role = 'admin' WHERE user_id = ?",
-                (user_id,)
-            )
+        if ctx.is_admin:
+            self.backend.set_user_role(user_id, 'admin')
             self._show_admin_menu(message)
         else:
-            user = self.backend.db.get_user(user_id)
+            user = ctx.user
             if user and user.get('phone'):
-                role = self.backend.get_user_role(user_id)
-                if role == 'driver':
+                if ctx.role == 'driver':
                     self._show_driver_menu(message)
                 else:
                     self.bot.send_message(
@@ -57,32 +96,23 @@ class Frontend:
                 self._request_contact(message)
     
     def _request_contact(self, message: types.Message):
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        contact_btn = types.KeyboardButton("📱 Отправить контакт", request_contact=True)
-        markup.add(contact_btn)
-        
         self.bot.send_message(
             message.chat.id,
             "👋 Добро пожаловать! Для работы в системе необходимо предоставить ваш номер телефона.\n\n"
             "Нажмите кнопку ниже чтобы отправить контакт:",
-            reply_markup=markup
+            reply_markup=CONTACT_MENU
         )
 
-    def handle_contact(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def handle_contact(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
         if message.contact:
             phone_number = message.contact.phone_number
             
             self.backend.update_user_phone(user_id, phone_number)
             
-            driver_info = self.backend.get_driver_info(user_id)
-            if driver_info:
-                self.backend.db.execute(
-                    "UPDATE drivers SET phone = ? WHERE user_id = ?",
-                    (phone_number, user_id)
-                )
+            if ctx.driver:
+                self.backend.update_driver_phone(user_id, phone_number)
                 
                 markup = types.ReplyKeyboardRemove()
                 self.bot.send_message(
@@ -105,96 +135,97 @@ class Frontend:
             )
 
     def _show_admin_menu(self, message: types.Message):
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("📊 Экспорт в Excel")
-        markup.add("🚚 Добавить водителя", "🗑️ Удалить водителя")
-        markup.add("👥 Управление группами", "📋 Список водителей")
-        markup.add("📨 Создать рассылку")
-        
         self.bot.send_message(
             message.chat.id,
             "👑 Панель администратора\n\n"
             "Выберите действие:",
-            reply_markup=markup
+            reply_markup=ADMIN_MENU
         )
 
     def _show_driver_menu(self, message: types.Message):
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("📋 Мои заказы")
-        
         self.bot.send_message(
             message.chat.id,
             "🚚 Панель водителя\n\n"
             "Доступные команды:\n"
             "/my_orders - история заказов",
-            reply_markup=markup
+            reply_markup=DRIVER_MENU
         )
     
-    def handle_admin_commands(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
-        
-        if not self.is_admin(user_id, username):
+    def handle_admin_commands(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
-        if message.text == "📊 Экспорт в Excel":
-            self._handle_export_excel(message)
-        elif message.text == "🚚 Добавить водителя":
-            self._start_add_driver(message)
-        elif message.text == "📨 Создать рассылку":
-            self._start_create_broadcast(message)
-        elif message.text == "📋 Список водителей":
-            self._handle_export_drivers(message)
-        elif message.text == "🗑️ Удалить водителя":
-            self._start_remove_driver(message)
-        elif message.text == "👥 Управление группами":
-            self._handle_group_management(message)
-        elif message.text == "➕ Добавить группу":
-            self._start_add_group(message)
-        elif message.text == "➖ Удалить группу":
-            self._handle_remove_group(message)
-        elif message.text == "📋 Список групп":
-            self._handle_list_groups(message)
-        elif message.text == "⬅️ Назад":
-            self._show_admin_menu(message)
+        handler = self.admin_commands.get(message.text)
+        if handler:
+            handler(message, ctx)
     
-    def _handle_export_users(self, message: types.Message):
-        users_data = self.backend.export_users()
-        if len(users_data) > 4096:
-            for x in range(0, len(users_data), 4096):
-                self.bot.send_message(message.chat.id, users_data[x:x+4096])
+    def _send_export_page(self, chat_id: int, kind: str, page: int = 0, message_id: int = None,
+                          after_id: int = None, before_id: int = None):
+        text, page, first_id, last_id, has_next = self.backend.get_export_page(kind, page, after_id, before_id)
+        if text is None:
+            return
+        
+        # В callback_data передаётся ключ соседней записи: следующая страница читается с него, а не с начала
+        markup = None
+        buttons = []
+        if page > 0:
+            buttons.append(types.InlineKeyboardButton("⬅️", callback_data=f"export_page_{kind}_{page - 1}_b{first_id}"))
+        if page > 0 or has_next:
+            buttons.append(types.InlineKeyboardButton(f"Стр. {page + 1}", callback_data="export_page_noop"))
+        if has_next:
+            buttons.append(types.InlineKeyboardButton("➡️", callback_data=f"export_page_{kind}_{page + 1}_a{last_id}"))
+        if buttons:
+            markup = types.InlineKeyboardMarkup()
+            markup.row(*buttons)
+        
+        if message_id is None:
+            self.bot.send_message(chat_id, text, reply_markup=markup)
         else:
-            self.bot.send_message(message.chat.id, users_data)
+            self.bot.edit_message_text(text, chat_id, message_id, reply_markup=markup)
     
-    def _handle_export_excel(self, message: types.Message):
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("📊 Пользователи Excel", "🚚 Водители Excel")
-        markup.add("⬅️ Назад")
+    def handle_export_page(self, call: types.CallbackQuery, ctx: UpdateContext):
+        if not ctx.is_admin:
+            self.bot.answer_callback_query(call.id, "🚫 У вас нет прав администратора")
+            return
         
+        if call.data == "export_page_noop":
+            self.bot.answer_callback_query(call.id)
+            return
+        
+        parts = call.data.split('_')
+        kind = parts[2]
+        page = int(parts[3])
+        after_id = before_id = None
+        if len(parts) > 4:
+            direction, key = parts[4][0], int(parts[4][1:])
+            if direction == 'b':
+                before_id = key
+            else:
+                after_id = key
+        
+        self._send_export_page(call.message.chat.id, kind, page, call.message.message_id, after_id, before_id)
+        self.bot.answer_callback_query(call.id)
+    
+    def _handle_export_excel(self, message: types.Message):
         self.bot.send_message(
             message.chat.id,
-            "Выберите что экспортировать в Excel:",
-            reply_markup=markup
+            "Выберите что экспортировать:",
+            reply_markup=EXPORT_MENU
         )
     
     def _handle_group_management(self, message: types.Message):
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("➕ Добавить группу", "➖ Удалить группу")
-        markup.add("📋 Список групп", "⬅️ Назад")
-        
         self.bot.send_message(
             message.chat.id,
             "👥 Управление группыми водителей\n\n"
             "Выберите действие:",
-            reply_markup=markup
+            reply_markup=GROUP_MENU
         )
 
-    def _start_add_group(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def _start_add_group(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
@@ -205,8 +236,8 @@ class Frontend:
             reply_markup=types.ReplyKeyboardRemove()
         )
 
-    def _handle_group_name(self, message: types.Message):
-        user_id = message.from_user.id
+    def _handle_group_name(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         group_name = message.text.strip()
         
         if not group_name:
@@ -220,31 +251,25 @@ class Frontend:
         
         try:
             group_id = self.backend.add_group(group_name)
-            self.user_states[user_id] = None
-            
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            markup.add("👥 Управление группами", "⬅️ Назад")
+            self.user_states.delete(user_id)
             
             self.bot.send_message(
                 message.chat.id,
                 f"✅ Группа '{group_name}' успешно создана!",
-                reply_markup=markup
+                reply_markup=GROUP_DONE_MENU
             )
         except Exception as e:
             self.bot.send_message(message.chat.id, f"❌ Ошибка при создании группы: {str(e)}")
 
-    def handle_remove_group(self, call: types.CallbackQuery):
-        user_id = call.from_user.id
-        username = call.from_user.username
-        
-        if not self.is_admin(user_id, username):
+    def handle_remove_group(self, call: types.CallbackQuery, ctx: UpdateContext):
+        if not ctx.is_admin:
             self.bot.answer_callback_query(call.id, "🚫 У вас нет прав администратора")
             return
         
         group_id = int(call.data.split('_')[2])
         
         try:
-            group = self.backend.db.get_group(group_id)
+            group = self.backend.get_group(group_id)
             if not group:
                 self.bot.answer_callback_query(call.id, "❌ Группа не найдена")
                 return
@@ -265,15 +290,12 @@ class Frontend:
                 call.message.message_id
             )
 
-    def _handle_list_groups(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
-        
-        if not self.is_admin(user_id, username):
+    def _handle_list_groups(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
-        groups = self.backend.get_all_groups()
+        groups = self.backend.get_group_driver_counts()
         
         if not groups:
             self.bot.send_message(message.chat.id, "❌ Нет созданных групп")
@@ -281,28 +303,52 @@ class Frontend:
         
         groups_list = "📋 Список групп:\n\n"
         for group in groups:
-            drivers_count = len(self.backend.get_drivers_by_group(group['group_id']))
-            groups_list += f"🏷️ {group['group_name']}: {drivers_count} водителей\n"
+            groups_list += f"🏷️ {group['group_name']}: {group['drivers_count']} водителей\n"
         
         self.bot.send_message(message.chat.id, groups_list)
 
-    def handle_export_excel_choice(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def _handle_remove_group(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
-        if message.text == "📊 Пользователи Excel":
-            self._export_users_excel(message)
-        elif message.text == "🚚 Водители Excel":
-            self._export_drivers_excel(message)
-        elif message.text == "⬅️ Назад":
-            self._show_admin_menu(message)
+        if not len(self.backend.groups):
+            self.bot.send_message(message.chat.id, "❌ Нет созданных групп")
+            return
+        
+        self.user_states[user_id] = 'awaiting_group_remove'
+        self.bot.send_message(
+            message.chat.id,
+            "Выберите группу для удаления:",
+            reply_markup=self.backend.groups.remove_keyboard()
+        )
 
-    def _handle_group_remove_confirmation(self, message: types.Message):
-        user_id = message.from_user.id
+    def _handle_group_remove(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.is_admin:
+            self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
+            return
+        
+        self._handle_group_remove_confirmation(message, ctx)
+
+    def handle_export_excel_choice(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.is_admin:
+            self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
+            return
+        
+        handler = self.export_commands.get(message.text)
+        if handler:
+            handler(message)
+
+    def _handle_group_remove_confirmation(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
+        
+        if not ctx.is_admin:
+            self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
+            self.clear_user_state(user_id)
+            return
+        
         group_name = message.text.replace("❌ ", "").strip()
         
         group = self.backend.get_group_by_name(group_name)
@@ -312,70 +358,131 @@ class Frontend:
         
         try:
             self.backend.delete_group(group['group_id'])
-            self.user_states[user_id] = None
-            
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            markup.add("👥 Управление группами", "⬅️ Назад")
+            self.user_states.delete(user_id)
             
             self.bot.send_message(
                 message.chat.id,
                 f"✅ Группа '{group_name}' успешно удалена!",
-                reply_markup=markup
+                reply_markup=GROUP_DONE_MENU
             )
         except Exception as e:
             self.bot.send_message(message.chat.id, f"❌ Ошибка при удалении группы: {str(e)}")
     
-    def _export_users_excel(self, message: types.Message):
+    EXPORT_CAPTIONS = {
+        'users': ("📊 Экспорт пользователей", "❌ Нет пользователей для экспорта"),
+        'drivers': ("🚚 Экспорт водителей", "❌ Нет водителей для экспорта"),
+    }
+    CHANGES_CAPTIONS = {
+        'users': "🔄 Изменения пользователей",
+        'drivers': "🔄 Изменения водителей",
+    }
+    
+    def _edit_job_status(self, chat_id: int, message_id: int, text: str):
         try:
-            filepath = self.backend.export_users_excel()
-            if not filepath:
-                self.bot.send_message(message.chat.id, "❌ Нет пользователей для экспорта")
-                return
-            
-            with open(filepath, 'rb') as file:
-                self.bot.send_document(
-                    message.chat.id,
-                    file,
-                    caption="📊 Экспорт пользователей"
-                )
-            
-            os.remove(filepath)
-            
+            self.bot.edit_message_text(text, chat_id, message_id)
         except Exception as e:
-            self.bot.send_message(message.chat.id, f"❌ Ошибка при экспорте: {str(e)}")
+            print(f"❌ Ошибка при обновлении статуса задачи: {e}")
     
-    def _export_drivers_excel(self, message: types.Message):
-        try:
-            filepath = self.backend.export_drivers_excel()
-            if not filepath:
-                self.bot.send_message(message.chat.id, "❌ Нет водителей для экспорта")
+    def _start_job(self, chat_id: int, kind: str, created_by: int, title: str, fn, on_done) -> bool:
+        status = self.bot.send_message(chat_id, f"⏳ {title}: в очереди")
+        
+        def on_progress(done: int, total: int):
+            self._edit_job_status(chat_id, status.message_id, f"⏳ {title}: {done}/{total}")
+        
+        def on_error(error: Exception):
+            self._edit_job_status(chat_id, status.message_id, f"❌ {title}: ошибка — {error}")
+        
+        job_id = self.jobs.submit(
+            kind, created_by, fn,
+            on_progress=on_progress,
+            on_done=lambda result: on_done(result, status.message_id),
+            on_error=on_error
+        )
+        if job_id is None:
+            self._edit_job_status(chat_id, status.message_id, "🚫 Слишком много фоновых задач, попробуйте позже")
+            return False
+        return True
+    
+    def _send_export(self, message: types.Message, kind: str, fmt: str):
+        caption, empty_text = self.EXPORT_CAPTIONS[kind]
+        chat_id = message.chat.id
+        
+        # Данные не менялись с прошлого экспорта: пересылаем уже загруженный файл
+        file_id = self.backend.get_cached_export(kind, fmt)
+        if file_id:
+            try:
+                self.bot.send_document(chat_id, file_id, caption=caption)
+                return
+            except Exception as e:
+                print(f"❌ Не удалось отправить кэшированный экспорт: {e}")
+                self.backend.forget_export(kind, fmt)
+        
+        version = self.backend.export_version(kind)
+        
+        def on_done(document, status_id: int):
+            if not document:
+                self._edit_job_status(chat_id, status_id, empty_text)
                 return
             
-            with open(filepath, 'rb') as file:
-                self.bot.send_document(
-                    message.chat.id,
-                    file,
-                    caption="🚚 Экспорт водителей"
-                )
-            
-            os.remove(filepath)
+            sent = self.bot.send_document(
+                chat_id,
+                document,
+                caption=caption,
+                visible_file_name=document.name
+            )
+            if sent and sent.document:
+                self.backend.remember_export(kind, fmt, version, sent.document.file_id)
+            self._edit_job_status(chat_id, status_id, f"✅ {caption}: готово")
+        
+        self._start_job(
+            chat_id, f"export_{kind}", message.from_user.id, caption,
+            lambda progress: self.backend.export_file(kind, fmt, progress),
+            on_done
+        )
+    
+    def _send_changes_export(self, message: types.Message, kind: str):
+        caption = self.CHANGES_CAPTIONS[kind]
+        chat_id = message.chat.id
+        since = self.backend.get_export_watermark(kind)
+        watermark = self.backend.next_export_watermark(kind)
+        
+        def on_done(document, status_id: int):
+            if not document:
+                self._edit_job_status(chat_id, status_id, "✅ Изменений с прошлой выгрузки нет")
+                return
             
-        except Exception as e:
-            self.bot.send_message(message.chat.id, f"❌ Ошибка при экспорте: {str(e)}")
+            self.bot.send_document(
+                chat_id,
+                document,
+                caption=f"{caption} с {since} (UTC)" if since else caption,
+                visible_file_name=document.name
+            )
+            if watermark:
+                self.backend.set_export_watermark(kind, watermark)
+            self._edit_job_status(chat_id, status_id, f"✅ {caption}: готово")
+        
+        self._start_job(
+            chat_id, f"export_{kind}_changes", message.from_user.id, caption,
+            lambda progress: self.backend.export_file(kind, 'xlsx', progress, since),
+            on_done
+        )
+    
+    def _csv_format(self) -> str:
+        return 'csv.gz' if self.config.get_export_csv_gzip() else 'csv'
+    
+    def _export_users_excel(self, message: types.Message):
+        self._send_export(message, 'users', 'xlsx')
+    
+    def _export_drivers_excel(self, message: types.Message):
+        self._send_export(message, 'drivers', 'xlsx')
     
     def _handle_export_drivers(self, message: types.Message):
-        drivers_data = self.backend.export_drivers()
-        if len(drivers_data) > 4096:
-            for x in range(0, len(drivers_data), 4096):
-                self.bot.send_message(message.chat.id, drivers_data[x:x+4096])
-        else:
-            self.bot.send_message(message.chat.id, drivers_data)
+        self._send_export_page(message.chat.id, 'drivers')
     
-    def _start_add_driver(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def _start_add_driver(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
@@ -386,11 +493,10 @@ class Frontend:
             reply_markup=types.ReplyKeyboardRemove()
         )
 
-    def _handle_add_driver_method(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def _handle_add_driver_method(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
@@ -411,11 +517,8 @@ class Frontend:
         elif message.text == "⬅️ Назад":
             self._show_admin_menu(message)
     
-    def _start_remove_driver(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
-        
-        if not self.is_admin(user_id, username):
+    def _start_remove_driver(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
@@ -438,11 +541,8 @@ class Frontend:
             reply_markup=markup
         )
     
-    def handle_remove_driver(self, call: types.CallbackQuery):
-        user_id = call.from_user.id
-        username = call.from_user.username
-        
-        if not self.is_admin(user_id, username):
+    def handle_remove_driver(self, call: types.CallbackQuery, ctx: UpdateContext):
+        if not ctx.is_admin:
             self.bot.answer_callback_query(call.id, "🚫 У вас нет прав администратора")
             return
         
@@ -465,16 +565,12 @@ class Frontend:
                 call.message.message_id
             )
     
-    def handle_driver_registration(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def handle_driver_registration(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
-            if user_id in self.user_states:
-                del self.user_states[user_id]
-            if user_id in self.temp_data:
-                del self.temp_data[user_id]
+            self.clear_user_state(user_id)
             return
         
         state = self.user_states.get(user_id)
@@ -506,29 +602,25 @@ class Frontend:
         
         elif state == 'awaiting_driver_fullname':
             full_name = message.text.strip()
-            self.temp_data[user_id]['full_name'] = full_name
+            # Изменения сохраняются только через запись значения целиком
+            data = self.temp_data.get(user_id, {})
+            data['full_name'] = full_name
+            self.temp_data[user_id] = data
             self.user_states[user_id] = 'awaiting_driver_group'
             
-            groups = self.backend.get_all_groups()
-            
-            if not groups:
+            if not len(self.backend.groups):
                 self.bot.send_message(
                     message.chat.id,
                     "❌ Нет созданных групп. Сначала создайте группы через меню '👥 Управление группами'"
                 )
                 self._show_admin_menu(message)
-                del self.user_states[user_id]
-                del self.temp_data[user_id]
+                self.clear_user_state(user_id)
                 return
             
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            for group in groups:
-                markup.add(group['group_name'])
-            
             self.bot.send_message(
                 message.chat.id,
                 "Выберите группу водителя:",
-                reply_markup=markup
+                reply_markup=self.backend.groups.keyboard()
             )
         
         elif state == 'awaiting_driver_group':
@@ -550,8 +642,7 @@ class Frontend:
             try:
                 self.backend.register_driver(driver_user_id, full_name, phone, group['group_id'])
                 
-                del self.user_states[user_id]
-                del self.temp_data[user_id]
+                self.clear_user_state(user_id)
                 
                 markup = types.ReplyKeyboardRemove()
                 self.bot.send_message(
@@ -570,43 +661,34 @@ class Frontend:
         cleaned_phone = ''.join(filter(str.isdigit, phone))
         return len(cleaned_phone) >= 10
     
-    def _start_create_broadcast(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def _start_create_broadcast(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
             return
         
-        groups = self.backend.get_all_groups()
-        if not groups:
+        if not len(self.backend.groups):
             self.bot.send_message(message.chat.id, "❌ Нет созданных групп. Сначала создайте группы через меню '👥 Управление группами'")
             return
         
         self.user_states[user_id] = 'awaiting_broadcast_photos'
         self.temp_data[user_id] = {'photos': []}
         
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("❌ Отмена")
-        
         self.bot.send_message(
             message.chat.id,
             "Отправьте до 6 фотографий для рассылки (или отправьте /skip чтобы пропустить):\n\n"
             "Для отмены нажмите '❌ Отмена'",
-            reply_markup=markup
+            reply_markup=CANCEL_MENU
         )
 
     
-    def handle_broadcast_photos(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def handle_broadcast_photos(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
-            if user_id in self.user_states:
-                del self.user_states[user_id]
-            if user_id in self.temp_data:
-                del self.temp_data[user_id]
+            self.clear_user_state(user_id)
             return
         
         if message.text == "❌ Отмена":
@@ -640,16 +722,12 @@ class Frontend:
                 self.user_states[user_id] = 'awaiting_broadcast_text'
                 self.bot.send_message(message.chat.id, "Введите текст рассылки:")
     
-    def handle_broadcast_text(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def handle_broadcast_text(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
-            if user_id in self.user_states:
-                del self.user_states[user_id]
-            if user_id in self.temp_data:
-                del self.temp_data[user_id]
+            self.clear_user_state(user_id)
             return
         
         if self.user_states.get(user_id) == 'awaiting_broadcast_text':
@@ -659,28 +737,18 @@ class Frontend:
             self.temp_data[user_id] = data
             self.user_states[user_id] = 'awaiting_broadcast_group'
             
-            groups = self.backend.get_all_groups()
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            for group in groups:
-                markup.add(group['group_name'])
-            markup.add("Все группы")
-            
             self.bot.send_message(
                 message.chat.id,
                 "Выберите группу для рассылки:",
-                reply_markup=markup
+                reply_markup=self.backend.groups.broadcast_keyboard()
             )
     
-    def handle_broadcast_group(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def handle_broadcast_group(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
-            if user_id in self.user_states:
-                del self.user_states[user_id]
-            if user_id in self.temp_data:
-                del self.temp_data[user_id]
+            self.clear_user_state(user_id)
             return
         
         if self.user_states.get(user_id) == 'awaiting_broadcast_group':
@@ -697,16 +765,12 @@ class Frontend:
                 reply_markup=types.ReplyKeyboardRemove()
             )
     
-    def handle_topic_name(self, message: types.Message):
-        user_id = message.from_user.id
-        username = message.from_user.username
+    def handle_topic_name(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
         
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
-            if user_id in self.user_states:
-                del self.user_states[user_id]
-            if user_id in self.temp_data:
-                del self.temp_data[user_id]
+            self.clear_user_state(user_id)
             return
         
         if self.user_states.get(user_id) == 'awaiting_topic_name':
@@ -714,33 +778,37 @@ class Frontend:
             data = self.temp_data.get(user_id, {})
             
             try:
-                if data.get('group_name') == "Все группы":
-                    order_id = self.backend.create_order_with_topic(
-                        user_id, data['text'], None, data['photos'], topic_name
-                    )
-                    self._send_broadcast_to_all_groups(order_id, data['text'], data['photos'], topic_name)
+                if data.get('group_name') == ALL_GROUPS:
+                    group_id = None
                 else:
                     group = self.backend.get_group_by_name(data['group_name'])
                     if not group:
                         self.bot.send_message(message.chat.id, "❌ Группа не найдена")
                         return
-                    
-                    order_id = self.backend.create_order_with_topic(
-                        user_id, data['text'], group['group_id'], data['photos'], topic_name
-                    )
-                    self._send_broadcast_to_group(order_id, group['group_id'], data['text'], data['photos'], topic_name)
+                    group_id = group['group_id']
                 
-                self._create_topic_in_group(topic_name, order_id, data['text'], data['photos'])
+                order_id = self.backend.create_order_with_topic(
+                    user_id, data['text'], group_id, data['photos'], topic_name
+                )
                 
-                del self.user_states[user_id]
-                del self.temp_data[user_id]
+                self.clear_user_state(user_id)
                 
-                markup = types.ReplyKeyboardRemove()
-                self.bot.send_message(
-                    message.chat.id,
-                    f"✅ Рассылка отправлена группе '{data.get('group_name', 'Все группы')}'\n"
-                    f"Топик '{topic_name}' создан в группе",
-                    reply_markup=markup
+                def broadcast(progress):
+                    if group_id is None:
+                        self._send_broadcast_to_all_groups(order_id, data['text'], data['photos'], topic_name, progress)
+                    else:
+                        self._send_broadcast_to_group(order_id, group_id, data['text'], data['photos'], topic_name, progress)
+                
+                def on_done(result, status_id: int):
+                    self._edit_job_status(
+                        message.chat.id, status_id,
+                        f"✅ Рассылка отправлена группе '{data.get('group_name', ALL_GROUPS)}'\n"
+                        f"Топик '{topic_name}' создан в группе"
+                    )
+                
+                self._start_job(
+                    message.chat.id, 'broadcast', user_id, f"Рассылка заказа #{order_id}",
+                    broadcast, on_done
                 )
                 self._show_admin_menu(message)
                 
@@ -765,10 +833,7 @@ class Frontend:
             
             topic_id = topic_result.message_thread_id
             
-            self.backend.db.execute(
-                "UPDATE orders SET topic_id = ? WHERE order_id = ?",
-                (topic_id, order_id)
-            )
+            self.backend.set_order_topic(order_id, topic_id)
             
             message_text = f"📦 Заказ #{order_id}: {topic_name}\n\n{text}"
             
@@ -860,81 +925,123 @@ class Frontend:
             except Exception as e2:
                 print(f"❌ Ошибка при отправке в общий чат: {e2}")
 
-    def _send_broadcast_to_group(self, order_id: int, group_id: int, text: str, photos: List[str], topic_name: str):
-        drivers = self.backend.get_drivers_by_group(group_id)
-        self._send_to_drivers(drivers, order_id, text, photos, topic_name)
+    def _send_broadcast_to_group(self, order_id: int, group_id: int, text: str, photos: List[str], topic_name: str, progress=None):
+        self.backend.enqueue_audience(order_id, [group_id])
+        self._run_broadcast(order_id, progress)
 
-    def _send_broadcast_to_all_groups(self, order_id: int, text: str, photos: List[str], topic_name: str):
-        all_drivers = []
-        groups = self.backend.get_all_groups()
-        for group in groups:
-            drivers = self.backend.get_drivers_by_group(group['group_id'])
-            all_drivers.extend(drivers)
-        self._send_to_drivers(all_drivers, order_id, text, photos, topic_name)
+    def _send_broadcast_to_all_groups(self, order_id: int, text: str, photos: List[str], topic_name: str, progress=None):
+        # Все водители, включая тех, у кого нет группы; каждый получает заказ один раз
+        self.backend.enqueue_audience(order_id)
+        self._run_broadcast(order_id, progress)
 
-    def _send_to_drivers(self, drivers: List[Dict], order_id: int, text: str, photos: List[str], topic_name: str):
-        for driver in drivers:
+    def _run_broadcast(self, order_id: int, progress=None):
+        # Топик создаётся до рассылки: без topic_id предложения водителей не попадут в группу.
+        # При возобновлении после сбоя недостающий топик создаётся заново
+        order = self.backend.get_order_info(order_id)
+        if not order:
+            return
+        if not order.get('topic_id'):
+            self._create_topic_in_group(order['topic_name'], order_id, order['description'], order.get('photos') or [])
+        self._drain_outbox(order_id, progress)
+
+    def _drain_outbox(self, order_id: int, progress=None):
+        order = self.backend.get_order_info(order_id)
+        if not order:
+            return
+        
+        text = order['description']
+        photos = order.get('photos') or []
+        topic_name = order.get('topic_name')
+        
+        def deliver(delivery: Dict):
             try:
-                if photos:
-                    media = [types.InputMediaPhoto(photo) for photo in photos]
-                    media[0].caption = f"📦 Новый заказ #{order_id} - {topic_name}:\n\n{text}"
-                    self.bot.send_media_group(driver['user_id'], media)
-                else:
-                    self.bot.send_message(
-                        driver['user_id'], 
-                        f"📦 Новый заказ #{order_id} - {topic_name}:\n\n{text}"
-                    )
-                
-                if driver['user_id'] not in self.temp_data:
-                    self.temp_data[driver['user_id']] = {}
-                self.temp_data[driver['user_id']]['current_order'] = order_id
-                self.temp_data[driver['user_id']]['current_topic'] = topic_name
-                
-                markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-                markup.add("💵 Предложить цену")
-                
-                self.bot.send_message(
-                    driver['user_id'],
-                    "Нажмите кнопку чтобы предложить свою цену за заказ:",
-                    reply_markup=markup
-                )
-                
+                self._deliver_order(delivery['driver_id'], order_id, text, photos, topic_name)
             except Exception as e:
-                print(f"Ошибка при отправке рассылки водителю {driver['user_id']}: {e}")
+                self.backend.mark_delivery_failed(delivery['outbox_id'], str(e), self.broadcaster.is_transient(e))
+                raise
+            self.backend.mark_delivery_sent(delivery['outbox_id'])
+        
+        self.broadcaster.run(self.backend.get_pending_deliveries(order_id), deliver, progress)
 
-    def handle_driver_price_request(self, message: types.Message):
-        user_id = message.from_user.id
-        driver = self.backend.get_driver_info(user_id)
+    def _deliver_order(self, chat_id: int, order_id: int, text: str, photos: List[str], topic_name: str):
+        caption = f"📦 Новый заказ #{order_id} - {topic_name}:\n\n{text}"
+        markup = offer_price_keyboard(order_id)
         
-        if not driver:
-            self.bot.send_message(message.chat.id, "❌ Вы не являетесь водителем")
+        if not photos:
+            self.broadcaster.call(chat_id, self.bot.send_message, chat_id, caption, reply_markup=markup)
             return
         
-        if user_id not in self.temp_data or 'current_order' not in self.temp_data[user_id]:
-            self.bot.send_message(message.chat.id, "❌ Нет активного заказа для предложения цены")
+        # К альбому нельзя прикрепить клавиатуру, поэтому кнопка уходит отдельным сообщением
+        media = [types.InputMediaPhoto(photo) for photo in photos]
+        media[0].caption = caption
+        self.broadcaster.call(chat_id, self.bot.send_media_group, chat_id, media)
+        self.broadcaster.call(
+            chat_id,
+            self.bot.send_message,
+            chat_id,
+            f"Нажмите кнопку чтобы предложить свою цену за заказ #{order_id}:",
+            reply_markup=markup
+        )
+
+    def resume_broadcasts(self):
+        for order_id in self.backend.get_orders_with_pending_deliveries():
+            job_id = self.jobs.submit(
+                'broadcast_resume', None,
+                lambda progress, order_id=order_id: self._run_broadcast(order_id, progress)
+            )
+            if job_id is None:
+                print(f"❌ Не удалось возобновить рассылку заказа #{order_id}: очередь задач заполнена")
+            else:
+                print(f"🔁 Возобновлена рассылка заказа #{order_id}")
+
+    def shutdown(self):
+        self.broadcaster.stop()
+        self.jobs.shutdown(wait=True)
+        self.user_states.close()
+        self.temp_data.close()
+        self.backend.db.close()
+
+    def handle_driver_price_request(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.driver:
+            self.bot.send_message(message.chat.id, "❌ Вы не являетесь водителем")
             return
         
-        order_id = self.temp_data[user_id]['current_order']
-        self.user_states[user_id] = f'awaiting_price_{order_id}'
-        
+        # Старая клавиатура без номера заказа: направляем к кнопке под сообщением с заказом
         self.bot.send_message(
             message.chat.id,
-            "Введите вашу цену за заказ:",
+            "ℹ️ Нажмите '💵 Предложить цену' под сообщением с нужным заказом",
             reply_markup=types.ReplyKeyboardRemove()
         )
 
-    def handle_driver_price(self, message: types.Message):
-        user_id = message.from_user.id
-        driver = self.backend.get_driver_info(user_id)
+    def handle_offer_price(self, call: types.CallbackQuery, ctx: UpdateContext):
+        user_id = ctx.user_id
+        order_id = int(call.data.split('_')[2])
+        
+        if not ctx.driver:
+            self.bot.answer_callback_query(call.id, "❌ Вы не являетесь водителем")
+            return
+        
+        if self.backend.is_order_taken(order_id):
+            self.bot.answer_callback_query(call.id, "❌ Заказ уже закреплен за другим водителем")
+            return
+        
+        self.user_states[user_id] = f'awaiting_price_{order_id}'
+        self.bot.answer_callback_query(call.id)
+        self.bot.send_message(user_id, f"Введите вашу цену за заказ #{order_id}:")
+
+    def handle_driver_price(self, message: types.Message, ctx: UpdateContext):
+        user_id = ctx.user_id
+        driver = ctx.driver
         
         if not driver:
             self.bot.send_message(message.chat.id, "❌ Вы не являетесь водителем")
             return
         
-        if user_id in self.user_states and self.user_states[user_id].startswith('awaiting_price_'):
+        state = self.user_states.get(user_id)
+        if state and state.startswith('awaiting_price_'):
             try:
                 price = float(message.text)
-                order_id = int(self.user_states[user_id].split('_')[2])
+                order_id = int(state.split('_')[2])
                 
                 self.backend.add_driver_offer(order_id, user_id, price)
                 
@@ -952,30 +1059,16 @@ class Frontend:
         else:
             self.bot.send_message(message.chat.id, "❌ Нет активного запроса на цену")
 
-    def handle_accept_offer(self, call: types.CallbackQuery):
+    def handle_accept_offer(self, call: types.CallbackQuery, ctx: UpdateContext):
         parts = call.data.split('_')
         order_id = int(parts[2])
         driver_id = int(parts[3])
         
-        user_id = call.from_user.id
-        username = call.from_user.username
-        
-        if not self.is_admin(user_id, username):
+        if not ctx.is_admin:
             self.bot.answer_callback_query(call.id, "🚫 У вас нет прав администратора")
             return
         
-        offers = self.backend.get_order_offers(order_id)
-        offer_id = None
-        for offer in offers:
-            if offer['driver_id'] == driver_id:
-                offer_id = offer['offer_id']
-                break
-        
-        if not offer_id:
-            self.bot.answer_callback_query(call.id, "❌ Предложение не найдено")
-            return
-        
-        success = self.backend.accept_driver_offer(offer_id)
+        success = self.backend.accept_driver_offer(order_id, driver_id)
         
         if success:
             self.bot.answer_callback_query(call.id, "✅ Предложение принято")
@@ -1014,24 +1107,41 @@ class Frontend:
                         )
                     except:
                         self.bot.send_message(self.group_id, completion_message)
+        elif self.backend.is_order_taken(order_id):
+            self.bot.answer_callback_query(call.id, "❌ Заказ уже закреплен за другим водителем")
         else:
-            self.bot.answer_callback_query(call.id, "❌ Ошибка при принятии предложения")
+            self.bot.answer_callback_query(call.id, "❌ Предложение не найдено")
 
-    def handle_order_accept(self, call: types.CallbackQuery):
-        driver_id = call.from_user.id
-        order_id = int(call.data.split('_')[2])
-        
-        driver = self.backend.get_driver_info(driver_id)
-        if not driver:
+    def handle_order_accept(self, call: types.CallbackQuery, ctx: UpdateContext):
+        if not ctx.driver:
             self.bot.answer_callback_query(call.id, "❌ Вы не являетесь водителем")
             return
         
         self.bot.send_message(
-            driver_id,
+            ctx.user_id,
             "ℹ️ Пожалуйста, используйте кнопку '💵 Предложить цену' для участия в заказе"
         )
         self.bot.answer_callback_query(call.id, "Используйте кнопку 'Предложить цену'")
 
+    def handle_stats(self, message: types.Message, ctx: UpdateContext):
+        if not ctx.is_admin:
+            self.bot.send_message(message.chat.id, "🚫 У вас нет прав администратора")
+            return
+        
+        response = "📈 Статистика кэша:\n\n"
+        for name, stats in self.backend.cache_stats().items():
+            response += (
+                f"{name}: {stats['size']}/{stats['max_size']}, "
+                f"попаданий {stats['hits']}, промахов {stats['misses']} "
+                f"({stats['hit_rate']:.0%})\n"
+            )
+        
+        if self.dispatcher:
+            depths = self.dispatcher.depths()
+            response += f"\n📥 Очереди обновлений: {', '.join(map(str, depths))} (всего {sum(depths)})\n"
+        
+        self.bot.send_message(message.chat.id, response)
+
     def handle_my_orders(self, message: types.Message):
         driver_id = message.from_user.id
         orders = self.backend.get_driver_orders_history(driver_id)
@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class JobRunner:
+    def __init__(self, db, workers: int = 2, max_pending: int = 10, progress_interval: float = 2.0):
+        self.db = db
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job')
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        # Задачи, оборванные перезапуском, больше не выполняются
+        self.db.interrupt_unfinished_jobs()
+
+    def submit(self, kind: str, created_by: int, fn: Callable[[ProgressCallback], Any],
+               on_progress: Optional[ProgressCallback] = None,
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None) -> Optional[int]:
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        try:
+            job_id = self.db.create_job(kind, created_by)
+            future = self._executor.submit(self._run, job_id, fn, on_progress, on_done, on_error)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._cancelled(job_id, future))
+        return job_id
+
+    def _cancelled(self, job_id: int, future):
+        # Отменённая задача так и не начиналась: _run не освободит слот и не запишет статус
+        if not future.cancelled():
+            return
+        self._slots.release()
+        self._finish(job_id, 'interrupted')
+
+    def _run(self, job_id: int, fn, on_progress, on_done, on_error):
+        last_report = [0.0]
+
+        def progress(done: int, total: int):
+            now = time.monotonic()
+            if done < total and now - last_report[0] < self.progress_interval:
+                return
+            last_report[0] = now
+            try:
+                self.db.update_job(job_id, progress=done, total=total)
+            except Exception as e:
+                # Прогресс необязателен: сбой записи не должен обрывать задачу
+                print(f"❌ Ошибка при сохранении прогресса задачи #{job_id}: {e}")
+            if on_progress:
+                try:
+                    on_progress(done, total)
+                except Exception as e:
+                    print(f"❌ Ошибка при обновлении прогресса задачи #{job_id}: {e}")
+
+        try:
+            self.db.update_job(job_id, status='running')
+            result = fn(progress)
+            self._finish(job_id, 'done')
+            if on_done:
+                on_done(result)
+        except Exception as e:
+            print(f"❌ Ошибка в задаче #{job_id}: {e}")
+            self._finish(job_id, 'failed', str(e))
+            if on_error:
+                try:
+                    on_error(e)
+                except Exception as e2:
+                    print(f"❌ Ошибка при обработке сбоя задачи #{job_id}: {e2}")
+        finally:
+            self._slots.release()
+
+    def _finish(self, job_id: int, status: str, error: str = None, attempts: int = 3):
+        # Итоговый статус записывается с повторами, чтобы задача не осталась в 'running'
+        for attempt in range(attempts):
+            try:
+                self.db.update_job(job_id, status=status, error=error, finished=True)
+                return
+            except Exception as e:
+                print(f"❌ Не удалось записать статус задачи #{job_id}: {e}")
+                time.sleep(0.5 * (attempt + 1))
+
+    def shutdown(self, wait: bool = True):
+        # Ещё не начатые задачи отменяются: после остановки не должно быть новых выгрузок и публикаций
+        self._executor.shutdown(wait=wait, cancel_futures=True)
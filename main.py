@@ -1,33 +1,61 @@
+import signal
 import telebot
 from frontend import Frontend
-from config_parser import ConfigParser
+from config_parser import get_config
+from router import Router
+from webhook import WebhookServer
+from dispatcher import ShardedDispatcher
 
 def main():
-    config = ConfigParser()
+    config = get_config()
     bot_token = config.get_bot_token()
     
     if not bot_token:
         print("Ошибка: не указан bot_token в конфигурационном файле")
         return
+    
+    mode = config.get_update_mode()
+    if mode not in ('polling', 'webhook'):
+        print(f"Ошибка: неизвестный update_mode '{mode}', ожидается 'polling' или 'webhook'")
+        return
+    if mode == 'webhook' and not config.get_webhook_secret():
+        print("Ошибка: для режима webhook не указан webhook_secret в конфигурационном файле")
+        return
 
-    bot = telebot.TeleBot(bot_token)
+    # Обработчики выполняются в потоках диспетчера, собственный пул telebot не нужен
+    bot = telebot.TeleBot(bot_token, threaded=False)
     frontend = Frontend(bot)
     
+    dispatcher = ShardedDispatcher(
+        bot,
+        shards=config.get_update_shards(),
+        queue_size=config.get_update_queue_size()
+    )
+    # Polling передаёт полученные обновления в шарды; при заполненной очереди опрос ждёт
+    bot.process_new_updates = dispatcher.submit_all
+    frontend.dispatcher = dispatcher
+    
+    def track_activity(messages):
+        for message in messages:
+            if message.from_user:
+                frontend.backend.touch_user(message.from_user.id)
+    
+    bot.set_update_listener(track_activity)
+    
     @bot.message_handler(commands=['start'])
     def handle_start(message):
         frontend.clear_user_state(message.from_user.id)
-        frontend.handle_start(message)
+        frontend.handle_start(message, frontend.context(message))
 
     @bot.message_handler(commands=['cancel'])
     def handle_cancel(message):
-        user_id = message.from_user.id
-        frontend.clear_user_state(user_id)
+        ctx = frontend.context(message)
+        frontend.clear_user_state(ctx.user_id)
         
-        if frontend.is_admin(user_id, message.from_user.username):
+        if ctx.is_admin:
             frontend._show_admin_menu(message)
         else:
-            driver = frontend.backend.get_driver_info(user_id)
-            if driver:
+            if ctx.driver:
                 frontend._show_driver_menu(message)
             else:
                 frontend.bot.send_message(
@@ -39,88 +67,96 @@ def main():
     def handle_my_orders(message):
         frontend.handle_my_orders(message)
     
+    @bot.message_handler(commands=['stats'])
+    def handle_stats(message):
+        frontend.handle_stats(message, frontend.context(message))
+    
+    def handle_default(message, ctx):
+        if ctx.is_admin:
+            frontend.handle_admin_commands(message, ctx)
+    
+    router = Router()
+    router.state_prefix('awaiting_driver', frontend.handle_driver_registration)
+    router.state('awaiting_broadcast_photos', handler=frontend.handle_broadcast_photos)
+    router.state('awaiting_broadcast_text', handler=frontend.handle_broadcast_text)
+    router.state('awaiting_broadcast_group', handler=frontend.handle_broadcast_group)
+    router.state('awaiting_topic_name', handler=frontend.handle_topic_name)
+    router.state('awaiting_group_name', handler=frontend._handle_group_name)
+    router.state('awaiting_group_remove', handler=frontend._handle_group_remove_confirmation)
+    router.state_prefix('awaiting_price_', frontend.handle_driver_price)
+    router.text(*frontend.export_commands, handler=frontend.handle_export_excel_choice)
+    router.text("👥 Управление группами", "➕ Добавить группу", "➖ Удалить группу", "📋 Список групп",
+                handler=frontend.handle_admin_commands)
+    router.text("💵 Предложить цену", handler=frontend.handle_driver_price_request)
+    router.text_prefix("❌ ", frontend._handle_group_remove)
+    router.fallback(handle_default)
+    
+    router.callback('accept_order_', frontend.handle_order_accept)
+    router.callback('remove_driver_', frontend.handle_remove_driver)
+    router.callback('remove_group_', frontend.handle_remove_group)
+    router.callback('offer_price_', frontend.handle_offer_price)
+    router.callback('accept_offer_', frontend.handle_accept_offer)
+    router.callback('export_page_', frontend.handle_export_page)
+    
     @bot.message_handler(func=lambda message: True)
     def handle_messages(message):
-        user_id = message.from_user.id
-        username = message.from_user.username
-        
-        state = frontend.user_states.get(user_id)
-        if state:
-            if state.startswith('awaiting_driver'):
-                frontend.handle_driver_registration(message)
-                return
-            elif state == 'awaiting_broadcast_photos':
-                frontend.handle_broadcast_photos(message)
-                return
-            elif state == 'awaiting_broadcast_text':
-                frontend.handle_broadcast_text(message)
-                return
-            elif state == 'awaiting_broadcast_group':
-                frontend.handle_broadcast_group(message)
-                return
-            elif state == 'awaiting_topic_name':
-                frontend.handle_topic_name(message)
-                return
-            elif state == 'awaiting_group_name':
-                frontend._handle_group_name(message)
-                return
-            elif state == 'awaiting_driver_phone':
-                frontend.handle_driver_registration(message)
-                return
-            elif state == 'awaiting_group_remove':
-                frontend._handle_group_remove_confirmation(message)
-                return
-            elif state.startswith('awaiting_price_'):
-                frontend.handle_driver_price(message)
-                return
-        
-        if message.text in ["📊 Пользователи Excel", "🚚 Водители Excel", "⬅️ Назад"]:
-            frontend.handle_export_excel_choice(message)
-            return
-        elif message.text in ["👥 Управление группами", "➕ Добавить группу", "➖ Удалить группу", "📋 Список групп"]:
-            frontend.handle_admin_commands(message)
-            return
-        elif message.text == "💵 Предложить цену":
-            frontend.handle_driver_price_request(message)
-            return
-        elif message.text.startswith("❌ "):
-            frontend._handle_group_remove(message)
-            return
-        
-        if frontend.is_admin(user_id, username):
-            frontend.handle_admin_commands(message)
+        ctx = frontend.context(message)
+        router.dispatch_message(message, frontend.user_states.get(ctx.user_id), ctx)
     
     @bot.message_handler(content_types=['photo'])
     def handle_photos(message):
-        user_id = message.from_user.id
-        username = message.from_user.username
-        state = frontend.user_states.get(user_id)
+        ctx = frontend.context(message)
+        state = frontend.user_states.get(ctx.user_id)
         
-        if state == 'awaiting_broadcast_photos' and frontend.is_admin(user_id, username):
-            frontend.handle_broadcast_photos(message)
+        if state == 'awaiting_broadcast_photos' and ctx.is_admin:
+            frontend.handle_broadcast_photos(message, ctx)
 
     @bot.message_handler(content_types=['contact'])
     def handle_contact(message):
-        frontend.handle_contact(message)
+        frontend.handle_contact(message, frontend.context(message))
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('accept_order_'))
+    @bot.callback_query_handler(func=lambda call: True)
     def handle_callback(call):
-        frontend.handle_order_accept(call)
+        router.dispatch_callback(call, frontend.context(call))
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('remove_driver_'))
-    def handle_remove_driver(call):
-        frontend.handle_remove_driver(call)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('remove_group_'))
-    def handle_remove_group(call):
-        frontend.handle_remove_group(call)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('accept_offer_'))
-    def handle_accept_offer(call):
-        frontend.handle_accept_offer(call)
+    server = None
+    if mode == 'webhook':
+        server = WebhookServer(
+            dispatcher.submit,
+            host=config.get_webhook_host(),
+            port=config.get_webhook_port(),
+            path=config.get_webhook_path(),
+            secret_token=config.get_webhook_secret()
+        )
+    
+    def handle_shutdown(signum, frame):
+        print("Остановка бота...")
+        if server:
+            server.stop()
+        else:
+            bot.stop_polling()
+    
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: config.reload(force=True))
+    
+    frontend.resume_broadcasts()
     
     print("Бот запущен...")
-    bot.polling(none_stop=True)
+    try:
+        if server:
+            webhook_url = config.get_webhook_url()
+            if webhook_url:
+                bot.set_webhook(url=webhook_url, secret_token=config.get_webhook_secret())
+            server.serve()
+        else:
+            bot.remove_webhook()
+            bot.polling(none_stop=True)
+    finally:
+        dispatcher.stop()
+        frontend.shutdown()
+        print("Бот остановлен")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
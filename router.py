@@ -0,0 +1,75 @@
+from typing import Any, Callable, Dict, Optional
+
+Handler = Callable[..., None]
+
+
+class PrefixTrie:
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, prefix: str, value: Any):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def longest_match(self, key: str) -> Optional[Any]:
+        # Ключ None в узле хранит значение для префикса, заканчивающегося в этом узле
+        node = self._root
+        match = node.get(None)
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            match = node.get(None, match)
+        return match
+
+
+class Router:
+    def __init__(self):
+        self._states: Dict[str, Handler] = {}
+        self._state_prefixes = PrefixTrie()
+        self._texts: Dict[str, Handler] = {}
+        self._text_prefixes = PrefixTrie()
+        self._callbacks = PrefixTrie()
+        self._fallback: Optional[Handler] = None
+
+    def state(self, *names: str, handler: Handler):
+        for name in names:
+            self._states[name] = handler
+
+    def state_prefix(self, prefix: str, handler: Handler):
+        self._state_prefixes.insert(prefix, handler)
+
+    def text(self, *texts: str, handler: Handler):
+        for text in texts:
+            self._texts[text] = handler
+
+    def text_prefix(self, prefix: str, handler: Handler):
+        self._text_prefixes.insert(prefix, handler)
+
+    def callback(self, prefix: str, handler: Handler):
+        self._callbacks.insert(prefix, handler)
+
+    def fallback(self, handler: Handler):
+        self._fallback = handler
+
+    def dispatch_message(self, message, state: Optional[str] = None, *args) -> bool:
+        handler = None
+        if state:
+            handler = self._states.get(state) or self._state_prefixes.longest_match(state)
+        if handler is None and message.text is not None:
+            handler = self._texts.get(message.text) or self._text_prefixes.longest_match(message.text)
+        if handler is None:
+            handler = self._fallback
+        if handler is None:
+            return False
+        handler(message, *args)
+        return True
+
+    def dispatch_callback(self, call, *args) -> bool:
+        handler = self._callbacks.longest_match(call.data or "")
+        if handler is None:
+            return False
+        handler(call, *args)
+        return True
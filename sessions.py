@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from cache import LRUCache, MISSING
+
+DELETED = object()
+
+
+class SessionStore(ABC):
+    @abstractmethod
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any):
+        ...
+
+    @abstractmethod
+    def delete(self, key: Hashable):
+        ...
+
+    def close(self):
+        pass
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: Hashable):
+        # Удаление отсутствующей сессии не считается ошибкой
+        self.delete(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, MISSING) is not MISSING
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400.0):
+        self._cache = LRUCache(max_entries, ttl)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: Hashable, value: Any):
+        self._cache.set(key, value)
+
+    def delete(self, key: Hashable):
+        self._cache.invalidate(key)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, db, namespace: str, max_entries: int = 10000, ttl: float = 86400.0,
+                 flush_interval: float = 1.0):
+        self.db = db
+        self.namespace = namespace
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.purge_interval = 60.0
+        self._next_purge = 0.0
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name=f'sessions-{namespace}', daemon=True)
+        self._thread.start()
+
+    def _remember(self, key: Hashable, value: Any, expires_at: float):
+        self._cache[key] = (value, expires_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._cache.move_to_end(key)
+                    return value
+                del self._cache[key]
+                return default
+            pending = self._pending.get(key)
+            if pending is DELETED:
+                return default
+            if pending is not None:
+                # Вытесненная из кэша, но ещё не сохранённая запись
+                value, expires_at = pending
+                return value if expires_at > now else default
+
+        row = self.db.get_session(self.namespace, str(key), now)
+        if row is None:
+            return default
+
+        value = json.loads(row['value'])
+        with self._lock:
+            # Пока шло чтение, значение могли перезаписать
+            if key in self._pending or key in self._cache:
+                entry = self._cache.get(key)
+                return entry[0] if entry and entry[1] > now else default
+            self._remember(key, value, row['expires_at'])
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._pending[key] = (value, expires_at)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._pending[key] = DELETED
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка при сохранении сессий '{self.namespace}': {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            saved, deleted = [], []
+            for key, item in pending.items():
+                if item is DELETED:
+                    deleted.append(str(key))
+                else:
+                    value, expires_at = item
+                    saved.append((self.namespace, str(key), json.dumps(value, ensure_ascii=False), expires_at))
+            try:
+                self.db.save_sessions(saved, self.namespace, deleted)
+                if time.monotonic() >= self._next_purge:
+                    self.db.purge_sessions(self.namespace, time.time(), self.max_entries)
+                    self._next_purge = time.monotonic() + self.purge_interval
+            except Exception:
+                # Не теряем изменения: вернём их в очередь, если их не перезаписали
+                with self._lock:
+                    for key, item in pending.items():
+                        self._pending.setdefault(key, item)
+                raise
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+
+def create_session_store(kind: str, db, namespace: str, max_entries: int, ttl: float,
+                         flush_interval: float = 1.0) -> SessionStore:
+    if kind == 'memory':
+        return MemorySessionStore(max_entries, ttl)
+    if kind == 'sqlite':
+        return SQLiteSessionStore(db, namespace, max_entries, ttl, flush_interval)
+    raise ValueError(f"Unknown session backend '{kind}', expected 'memory' or 'sqlite'")
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from db import Database
+
+DRIVERS = 16
+
+
+class AcceptOfferConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp.name, 'test.sqlite3')
+        self.db = Database(self.db_name, pool_size=DRIVERS)
+        self.db.upsert_users([{'user_id': 1, 'username': 'admin'}])
+        self.db.upsert_users([{'user_id': 100 + i, 'username': f'driver{i}'} for i in range(DRIVERS)])
+        self.db.upsert_drivers([
+            {'user_id': 100 + i, 'full_name': f'Driver {i}', 'phone': f'7999000{i:04d}', 'group_id': None}
+            for i in range(DRIVERS)
+        ])
+        self.order_id = self.db.add_order(1, 'test order', None, [])
+        for i in range(DRIVERS):
+            self.db.add_driver_offer(self.order_id, 100 + i, 1000 + i)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def _race(self, database_for):
+        barrier = threading.Barrier(DRIVERS)
+        results = {}
+
+        def accept(driver_id: int):
+            database = database_for(driver_id)
+            barrier.wait()
+            results[driver_id] = database.accept_driver_offer(self.order_id, driver_id)
+
+        threads = [threading.Thread(target=accept, args=(100 + i,)) for i in range(DRIVERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _assert_single_winner(self, results):
+        winners = [driver_id for driver_id, accepted in results.items() if accepted]
+        self.assertEqual(len(winners), 1)
+
+        responses = self.db.fetch_all("SELECT driver_id FROM order_responses WHERE order_id = ?", (self.order_id,))
+        self.assertEqual([row['driver_id'] for row in responses], winners)
+
+        offers = self.db.fetch_all("SELECT driver_id FROM driver_offers WHERE order_id = ?", (self.order_id,))
+        self.assertEqual([row['driver_id'] for row in offers], winners)
+
+    def test_single_winner_shared_pool(self):
+        self._assert_single_winner(self._race(lambda driver_id: self.db))
+
+    def test_single_winner_separate_connections(self):
+        # Отдельные экземпляры Database ведут себя как независимые процессы
+        databases = {100 + i: Database(self.db_name, pool_size=1) for i in range(DRIVERS)}
+        try:
+            self._assert_single_winner(self._race(databases.get))
+        finally:
+            for database in databases.values():
+                database.close()
+
+    def test_accept_after_winner_fails(self):
+        self.assertTrue(self.db.accept_driver_offer(self.order_id, 100))
+        self.assertFalse(self.db.accept_driver_offer(self.order_id, 101))
+        self.assertFalse(self.db.accept_driver_offer(self.order_id, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
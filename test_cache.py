@@ -0,0 +1,57 @@
+import threading
+import unittest
+
+from cache import LRUCache, MISSING
+
+
+class GetOrLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(max_size=16, ttl=300.0)
+        self.loading = threading.Event()
+        self.release = threading.Event()
+
+    def _slow_loader(self, value):
+        def load():
+            self.loading.set()
+            self.release.wait(5)
+            return value
+        return load
+
+    def _load_concurrently(self, key, value, during_load):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.cache.get_or_load(key, self._slow_loader(value))))
+        thread.start()
+        self.assertTrue(self.loading.wait(5))
+        during_load()
+        self.release.set()
+        thread.join()
+        return results[0]
+
+    def test_loaded_value_is_cached(self):
+        self.assertEqual(self.cache.get_or_load(50, lambda: 'row'), 'row')
+        self.assertEqual(self.cache.get(50), 'row')
+
+    def test_invalidate_during_load_discards_stale_value(self):
+        value = self._load_concurrently(50, None, lambda: self.cache.invalidate(50))
+        self.assertIsNone(value)
+        self.assertIs(self.cache.get(50), MISSING)
+        self.assertEqual(self.cache.get_or_load(50, lambda: 'fresh'), 'fresh')
+
+    def test_clear_during_load_discards_stale_value(self):
+        self._load_concurrently(50, None, self.cache.clear)
+        self.assertIs(self.cache.get(50), MISSING)
+
+    def test_set_during_load_wins(self):
+        self._load_concurrently(50, 'stale', lambda: self.cache.set(50, 'fresh'))
+        self.assertEqual(self.cache.get(50), 'fresh')
+
+    def test_failed_load_is_not_cached(self):
+        def fail():
+            raise RuntimeError('db down')
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_load(50, fail)
+        self.assertIs(self.cache.get(50), MISSING)
+
+
+if __name__ == '__main__':
+    unittest.main()
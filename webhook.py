@@ -0,0 +1,73 @@
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from telebot import types
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    def __init__(self, submit: Callable[..., bool], host: str = '0.0.0.0', port: int = 8443,
+                 path: str = '/webhook', secret_token: str = None):
+        self.submit = submit
+        self.path = path
+        self.secret_token = secret_token
+        self._stopped = threading.Event()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    def _handler_class(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.send_response(webhook.accept(self.path, self.headers, self.rfile))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def accept(self, path: str, headers, body) -> int:
+        if path != self.path:
+            return 404
+        token = headers.get('X-Telegram-Bot-Api-Secret-Token') or ''
+        if not self.secret_token or not hmac.compare_digest(token, self.secret_token):
+            return 403
+
+        try:
+            length = int(headers.get('Content-Length') or 0)
+        except ValueError:
+            return 400
+        if length <= 0:
+            return 400
+        if length > MAX_BODY_SIZE:
+            return 413
+
+        try:
+            update = types.Update.de_json(json.loads(body.read(length)))
+        except (ValueError, KeyError, TypeError):
+            return 400
+
+        if not self.submit(update, block=False):
+            # Telegram повторит доставку позже: так очередь не растёт без ограничений
+            return 503
+        return 200
+
+    def serve(self):
+        server_thread = threading.Thread(target=self._server.serve_forever, name='webhook-http', daemon=True)
+        server_thread.start()
+
+        # serve_forever работает в отдельном потоке, чтобы stop() можно было вызвать из обработчика сигнала
+        self._stopped.wait()
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stop(self):
+        self._stopped.set()